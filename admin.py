@@ -1,41 +1,142 @@
 import asyncio
 import functools
-import os
+import shlex
+import tempfile
+import time
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from pathlib import Path
 from loguru import logger
 import click
 import hikari
 import pytz
-from dotenv import load_dotenv
 from hikari.impl import RESTClientImpl
 from pydantic import BaseModel
 
 from src import repository, service
-from src.message_processing import process_message
+from src import backup as backups
+from src.backfill import Backfill, BackfillSource
+from src import verify as verifier
+from src.journal import JournalEntry
+from src.message_processing import (
+    gtg_first_date,
+    process_journal_entry,
+    process_message,
+)
+from src.ranking import streak_index
 from src.repository import snowflake_to_datetime
-
-load_dotenv()
-token = os.getenv("TOKEN")
+from src.settings import settings
+from src.utils import Leaderboard, Period, period_key
 
 utc = pytz.timezone("UTC")
 
+guild_option = click.option(
+    "-g",
+    "--guild",
+    type=int,
+    default=lambda: settings.server_id,
+    required=True,
+    show_default="SERVER_ID",
+)
+channel_option = click.option(
+    "-c",
+    "--channel",
+    type=int,
+    default=lambda: settings.gtg_channel_id,
+    show_default="GTG_CHANNEL_ID",
+)
+
+
+def parse_as_of(ctx, param, value: str | None) -> date | None:
+    """A day as YYYY-MM-DD or a GuessThe.Game round number."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return gtg_first_date + timedelta(days=int(value) - 1)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter("expected YYYY-MM-DD or a round number")
+
+
+def parse_point(ctx, param, value: str | None) -> int | None:
+    """A message snowflake or a datetime, as the snowflake of that moment."""
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    point = click.DateTime().convert(value, param, ctx).astimezone()
+    return int(hikari.Snowflake.from_datetime(point))
+
+
+as_of_option = click.option(
+    "--as-of",
+    callback=parse_as_of,
+    help="As it was after this day (YYYY-MM-DD) or round number",
+)
+
+
+class AdminSession:
+    """Event loop and Discord REST client shared by the commands of a session.
+
+    A single command runs in a session of its own, batch and shell run all
+    their commands in one so the client and fetched names are reused.
+    """
+
+    def __init__(self):
+        self.runner = asyncio.Runner()
+        self.member_names = dict[tuple[int, int], str]()
+        self._rest_app: hikari.RESTApp | None = None
+        self._client: RESTClientImpl | None = None
+        self._client_lock = asyncio.Lock()
+
+    def __enter__(self) -> "AdminSession":
+        global session
+        session = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global session
+        session = None
+        self.runner.run(self.close())
+        self.runner.close()
+
+    def run(self, coro):
+        return self.runner.run(coro)
+
+    async def client(self) -> RESTClientImpl:
+        async with self._client_lock:
+            if self._client is None:
+                self._rest_app = hikari.RESTApp()
+                await self._rest_app.start()
+                self._client = self._rest_app.acquire(
+                    token_type="Bot", token=settings.require_token()
+                )
+                self._client.start()
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            await self._rest_app.close()
+            self._client = self._rest_app = None
+
+
+session: AdminSession | None = None
+
 
 @asynccontextmanager
 async def get_client() -> RESTClientImpl:
-    rest_app = hikari.RESTApp()
-    await rest_app.start()
-    async with rest_app.acquire(token_type="Bot", token=os.environ["TOKEN"]) as client:
-        try:
-            yield client
-        finally:
-            await rest_app.close()
+    yield await session.client()
 
 
 def make_sync(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        return asyncio.run(func(*args, **kwargs))
+        if session is not None:
+            return session.run(func(*args, **kwargs))
+        with AdminSession() as s:
+            return s.run(func(*args, **kwargs))
 
     return wrapper
 
@@ -46,28 +147,54 @@ async def cli():
     pass
 
 
+@cli.command()
+@make_sync
+@click.argument("guild_id", type=int)
+@click.argument("channel_id", type=int, required=False)
+async def guild(guild_id, channel_id):
+    """Sets the results channel of a guild, the bot picks it up on next start"""
+    click.echo(repository.set_guild_channel(guild_id, channel_id))
+
+
+@cli.command()
+@make_sync
+async def guilds():
+    click.echo("Guilds:")
+    for g in repository.get_all_guilds():
+        click.echo(g)
+
+
 @cli.command()
 @make_sync
 @click.argument("user_id", required=False)
+@guild_option
 @click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
-async def players(user_id, name):
+async def players(user_id, guild, name):
     """Outputs one player if DISCORD_ID provided, else all players"""
     if user_id:
         click.echo("Player:")
-        p = repository.get_player(user_id=int(user_id))
-        await print_model(model=p, user_id=user_id, name=name)
+        p = repository.get_player(guild_id=guild, user_id=int(user_id))
+        await print_model(model=p, guild_id=guild, user_id=user_id, name=name)
     else:
         click.echo("Players:")
-        for p in service.get_all_players():
-            await print_model(model=p, user_id=p.user_id, name=name)
+        players = service.get_all_players(guild)
+        names = await get_discord_member_names(
+            [p.user_id for p in players], guild, name
+        )
+        for p, p_name in zip(players, names):
+            click.echo(f"Name={p_name or 'excluded'} {p.model_dump_json()}")
 
 
 @cli.command()
 @make_sync
 @click.argument("user_id")
 @click.argument("message_id")
-async def add_player(user_id, message_id):
-    repository.add_player(user_id=user_id, message_id=message_id)
+@guild_option
+async def add_player(user_id, message_id, guild):
+    try:
+        repository.add_player(guild_id=guild, user_id=user_id, message_id=message_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
 
 
 @cli.command("toggle-participation")
@@ -76,16 +203,19 @@ async def add_player(user_id, message_id):
 @click.argument(
     "participation-type", type=click.Choice(["visible", "active"]), required=True
 )
+@guild_option
 @click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
-async def toggle_participation(user_id, participation_type, name):
+async def toggle_participation(user_id, participation_type, guild, name):
     toggle = (
         service.toggle_player_visible
         if participation_type == "visible"
         else service.toggle_player_active
     )
-    updated_participation_val = toggle(user_id=user_id)
+    updated_participation_val = toggle(guild_id=guild, user_id=user_id)
 
-    user_display_val = await get_discord_member_name(user_id) if name else user_id
+    user_display_val = (
+        await get_discord_member_name(user_id, server_id=guild) if name else user_id
+    )
     print(
         f"User {user_display_val} has attribute {participation_type} set to {updated_participation_val}"
     )
@@ -95,45 +225,161 @@ async def toggle_participation(user_id, participation_type, name):
 @make_sync
 @click.argument("user_id", type=int, required=False)
 @click.option("-l", "--limit", type=int)
-async def results(user_id: int, limit: int):
+@guild_option
+async def results(user_id: int, limit: int, guild: int):
     click.echo("Results:")
-    for r in repository.get_all_results(user_id=user_id, limit=limit):
+    for r in repository.get_all_results(guild_id=guild, user_id=user_id, limit=limit):
         click.echo(r)
 
 
 @cli.command()
 @make_sync
+@guild_option
 @click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
-async def streak_chart(name):
-    streaks = service.generate_streak_chart()
-    click.echo("Streaks")
-    for s in streaks:
-        p_name = await get_discord_member_name(s.user_id) if name else None
-        click.echo(f"{s} {p_name}")
+@click.option(
+    "-t",
+    "--typ",
+    type=click.Choice([lb.value for lb in Leaderboard]),
+    default=Leaderboard.CURRENT_STREAK.value,
+    show_default=True,
+)
+@click.option(
+    "-l",
+    "--limit",
+    type=int,
+    help="Players shown  [default: all on current_streak, 10 on the others]",
+)
+@click.option(
+    "--min-games",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Results needed to rank on win rate and average guesses",
+)
+@as_of_option
+async def streak_chart(guild, name, typ, limit, min_games, as_of):
+    chart = service.generate_leaderboard(
+        guild, Leaderboard(typ), limit, min_games, as_of
+    )
+    click.echo(f"{typ}{f' as of {as_of}' if as_of else ''}:")
+    names = await get_discord_member_names([e.user_id for e in chart], guild, name)
+    for entry, p_name in zip(chart, names):
+        click.echo(f"{entry} {p_name}")
+
+
+@cli.command()
+@make_sync
+@click.argument("user_id", type=int)
+@guild_option
+@click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
+@click.option(
+    "-c",
+    "--count",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Players shown above and below",
+)
+async def rank(user_id, guild, name, count):
+    """Shows the streak chart position of a player and its neighbours"""
+    ranks = streak_index.neighbours(guild, user_id, count)
+    if not ranks:
+        click.echo("Player is not on the streak chart")
+        return
+
+    click.echo(f"Rank of {ranks[0].total} players:")
+    names = await get_discord_member_names(
+        [r.streak.user_id for r in ranks], guild, name
+    )
+    for r, p_name in zip(ranks, names):
+        marker = "*" if r.streak.user_id == user_id else " "
+        click.echo(f"{marker}{r.position}. {r.streak} {p_name}")
+
+
+@cli.command()
+@make_sync
+@guild_option
+@click.option(
+    "-p",
+    "--period",
+    type=click.Choice([p.value for p in Period]),
+    default=Period.MONTH.value,
+    show_default=True,
+)
+@click.option(
+    "-d",
+    "--day",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="A day in the week or month, today if not given",
+)
+@click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
+async def period_chart(guild, period, day, name):
+    """Shows the week or month chart"""
+    day = day.date() if day else date.today()
+    click.echo(f"{period_key(Period(period), day)}:")
+    chart = repository.get_period_chart(guild, Period(period), day)
+    names = await get_discord_member_names([pt.user_id for pt in chart], guild, name)
+    for pt, p_name in zip(chart, names):
+        click.echo(f"{pt} {p_name}")
+
+
+@cli.command()
+@make_sync
+@click.option("-g", "--guild", type=int, help="Only this guild, else all guilds")
+async def rebuild_periods(guild):
+    """Recomputes the week and month totals from stored results"""
+    count = repository.rebuild_period_totals(guild)
+    click.echo(f"Rebuilt {count} week and month totals")
+
+
+@cli.command()
+@make_sync
+@click.option("-g", "--guild", type=int, help="Only this guild, else all guilds")
+async def rebuild_histograms(guild):
+    """Recounts the guess distributions from stored results"""
+    count = repository.rebuild_guess_counts(guild)
+    click.echo(f"Counted {count} results")
+
+
+@cli.command()
+@make_sync
+@click.option("-g", "--guild", type=int, help="Only this guild, else all guilds")
+async def rebuild_histories(guild):
+    """Re-encodes the round histories of players from stored results"""
+    count = repository.rebuild_result_histories(guild)
+    click.echo(f"Encoded {count} player histories")
+
+
+@cli.command()
+@make_sync
+@click.argument("user_id", type=int, required=False)
+@guild_option
+async def distribution(user_id, guild):
+    """Shows the guess distribution of a player, or of the guild without one"""
+    dist = repository.get_guess_distribution(guild, user_id)
+    click.echo(f"Guess distribution of {dist.played} results:")
+    click.echo(service.format_guess_distribution(dist))
 
 
 @cli.command(name="stats")
 @make_sync
 @click.argument("user_id", required=True)
+@guild_option
 @click.option("-n", "--name", help="Fetch and display discord username", is_flag=True)
-async def player_stats(user_id, name):
-    click.echo("Player Stats:")
-    stats = repository.get_player_total(user_id)
-    await print_model(model=stats, user_id=user_id, name=name)
+@as_of_option
+async def player_stats(user_id, guild, name, as_of):
+    click.echo(f"Player Stats{f' as of {as_of}' if as_of else ''}:")
+    profile = repository.get_player_profile(guild, user_id, as_of=as_of)
+    await print_model(model=profile, guild_id=guild, user_id=user_id, name=name)
 
 
 @cli.command(name="message")
 @make_sync
 @click.argument("message", required=True)
-@click.option(
-    "-c",
-    "--channel",
-    type=int,
-    envvar="GTG_CHANNEL_ID",
-    show_default=True,
-)
+@channel_option
 @click.option("-p", "--process", is_flag=True)
-async def fetch_message(channel: int, message: int, process):
+@guild_option
+async def fetch_message(channel: int, message: int, process, guild):
     click.echo("Message:")
     async with get_client() as client:
         msg = await client.fetch_message(channel=channel, message=message)
@@ -148,6 +394,7 @@ async def fetch_message(channel: int, message: int, process):
             message_content=msg.content,
             message_id=int(msg.id),
             author_id=int(msg.author.id),
+            guild_id=guild,
         )
 
         if res:
@@ -179,14 +426,9 @@ async def fetch_message(channel: int, message: int, process):
     default="snowflake",
 )
 @click.argument("to-val", type=str, required=False)
-@click.option(
-    "-c",
-    "--channel",
-    type=int,
-    envvar="GTG_CHANNEL_ID",
-    show_default=True,
-)
-async def collect_channel_history(from_type, from_val, to_type, to_val, channel):
+@channel_option
+@guild_option
+async def collect_channel_history(from_type, from_val, to_type, to_val, channel, guild):
     """Collects channel history from message snowflake or datetime values."""
 
     def parse_val(point_type, val: str) -> int | datetime:
@@ -250,6 +492,7 @@ async def collect_channel_history(from_type, from_val, to_type, to_val, channel)
                 message_content=msg.content,
                 message_id=int(msg.id),
                 author_id=int(msg.author.id),
+                guild_id=guild,
             )
             if res:
                 match_count += 1
@@ -269,6 +512,275 @@ async def collect_channel_history(from_type, from_val, to_type, to_val, channel)
         click.echo("No messages read")
 
 
+@cli.command()
+@make_sync
+@click.option(
+    "-c",
+    "--channel",
+    "channels",
+    type=int,
+    multiple=True,
+    help="Channel to read, repeatable. The guild's results channel by default",
+)
+@click.option("--dms", is_flag=True, help="Also read the DMs of the guild's players")
+@click.option(
+    "--after",
+    callback=parse_point,
+    help="Snowflake or datetime to read from, the first GuessThe.Game round by default",
+)
+@click.option("--before", callback=parse_point, help="Snowflake or datetime to stop at")
+@click.option(
+    "--rate", type=int, default=40, show_default=True, help="Requests per second"
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=5.0,
+    show_default=True,
+    help="Seconds between progress reports",
+)
+@guild_option
+async def backfill(channels, dms, after, before, rate, interval, guild):
+    """Reads the history of channels and DMs at once and registers their results.
+
+    Messages of all channels are registered oldest first, a result already
+    stored is reported as a duplicate and left as it is.
+    """
+    if after is None:
+        after = int(
+            hikari.Snowflake.from_datetime(
+                datetime.combine(gtg_first_date, datetime.min.time()).astimezone()
+            )
+        )
+    if not channels and not dms:
+        g = repository.get_guild(guild)
+        channels = [g.channel_id if g and g.channel_id else settings.gtg_channel_id]
+
+    async with get_client() as client:
+        sources = [BackfillSource(c, guild, f"#{c}") for c in channels]
+        if dms:
+            for p in repository.get_all_players(guild, inactive=True):
+                try:
+                    dm = await client.create_dm_channel(p.user_id)
+                except hikari.HTTPError as e:
+                    logger.warning("No DM channel with {}: {}", p.user_id, e)
+                    continue
+                sources.append(BackfillSource(int(dm.id), None, f"DM {p.user_id}"))
+
+        job = Backfill(
+            client,
+            sources,
+            after=after,
+            before=snowflake_to_datetime(before).astimezone() if before else None,
+            rate=rate,
+        )
+        click.echo(
+            f"Reading {len(sources)} channels from {snowflake_to_datetime(after).astimezone()}"
+        )
+
+        async def ingest(source: BackfillSource, message: hikari.Message):
+            entry = JournalEntry(
+                message_id=int(message.id),
+                channel_id=source.channel_id,
+                guild_id=source.guild_id,
+                author_id=int(message.author.id),
+                content=message.content,
+            )
+            return await asyncio.to_thread(process_journal_entry, entry)
+
+        async def report():
+            reported = dict[int, int]()
+            while True:
+                await asyncio.sleep(interval)
+                for progress in job.progress.values():
+                    channel_id = progress.source.channel_id
+                    if reported.get(channel_id) == progress.fetched:
+                        continue
+                    reported[channel_id] = progress.fetched
+                    at = progress.last_timestamp
+                    click.echo(
+                        f"  {progress.source.label}: {progress.fetched} messages"
+                        f"{f', at {at.astimezone():%Y-%m-%d %H:%M}' if at else ''}"
+                        f"{', done' if progress.done else ''}"
+                    )
+                done = sum(p.done for p in job.progress.values())
+                click.echo(
+                    f"{job.stats.messages} messages registered, {job.stats.results_added} results added, "
+                    f"{job.stats.rate:.1f} messages/s, {done}/{len(sources)} channels done"
+                )
+
+        reporter = asyncio.create_task(report())
+        try:
+            stats = await job.run(ingest)
+        finally:
+            reporter.cancel()
+
+    for progress in job.progress.values():
+        if progress.error:
+            click.echo(f"  {progress.source.label}: failed, {progress.error}")
+    requests = sum(p.requests for p in job.progress.values())
+    click.echo(
+        f"{stats.messages} messages read with {requests} requests, {stats.matched} matches found, "
+        f"{stats.players_added} players added, {stats.games_added} games added, "
+        f"{stats.results_added} results added, {stats.rate:.1f} messages/s."
+    )
+
+
+@cli.command()
+@click.option(
+    "-w", "--workers", type=int, help="Worker processes, one per CPU by default"
+)
+def verify(workers):
+    """Checks results, games and derived statistics for inconsistencies"""
+    report = verifier.verify(workers=workers)
+    for m in report.mismatches:
+        player = f"guild {m.guild_id} player {m.user_id}: " if m.user_id else ""
+        click.echo(f"[{m.check}] {player}{m.detail}")
+
+    click.echo(
+        f"{len(report.mismatches)} mismatches in {report.players} players and "
+        f"{report.results} results, {report.seconds:.2f}s with {report.workers} workers "
+        f"({report.players / report.seconds:.0f} players/s, "
+        f"{report.results / report.seconds:.0f} results/s)"
+    )
+
+
+def sqlite_database() -> Path:
+    if settings.db_provider != "sqlite":
+        raise click.UsageError("Backups are made of the SQLite database, use pg_dump")
+    from src.models import db_params
+
+    return Path(db_params["filename"])
+
+
+def echo_backup_report(action: str, report: backups.BackupReport):
+    click.echo(
+        f"{action} {report.path} ({report.size / (1 << 20):.2f} MiB): "
+        f"{report.pages} pages in {report.seconds:.2f}s "
+        f"({report.throughput / (1 << 20):.1f} MiB/s), "
+        f"longest step {report.longest_step * 1000:.1f}ms, "
+        f"{report.restarts} restarts"
+    )
+
+
+@cli.command()
+@click.argument("target", type=click.Path(path_type=Path), required=False)
+@click.option(
+    "--plain", is_flag=True, help="Copy the database as is instead of a snapshot"
+)
+@click.option(
+    "--pages", type=int, default=256, show_default=True, help="Pages copied per step"
+)
+@click.option(
+    "--pause",
+    type=float,
+    default=0.005,
+    show_default=True,
+    help="Seconds writers get between steps",
+)
+def backup(target, plain, pages, pause):
+    """Backs up the live database without stopping the bot
+
+    Writes a compressed snapshot with a checksum to the backup directory
+    unless TARGET is given.
+    """
+    source = sqlite_database()
+    if target is None:
+        target = source.parent / settings.backup_dir / backups.snapshot_name()
+    if plain:
+        report = backups.copy_database(source, target, pages, pause)
+    else:
+        report = backups.write_snapshot(source, target, pages, pause)
+    echo_backup_report("Wrote", report)
+
+
+@cli.command()
+@click.argument("snapshot", type=click.Path(exists=True, path_type=Path))
+@click.option("--check", is_flag=True, help="Only verify the snapshot")
+@click.option("-y", "--yes", is_flag=True, help="Do not ask for confirmation")
+def restore(snapshot, check, yes):
+    """Restores the database from a snapshot after checking it
+
+    Restart a running bot afterwards, its rankings are kept in memory.
+    """
+    target = sqlite_database()
+    try:
+        if check:
+            with tempfile.TemporaryDirectory(dir=target.parent) as tmp:
+                manifest = backups.check_snapshot(snapshot, Path(tmp) / "check.db")
+            click.echo(
+                f"Snapshot of {manifest['source']} from {manifest['created']} is ok"
+            )
+            return
+
+        if not yes:
+            click.confirm(
+                f"Replace the content of {target} with the snapshot?", abort=True
+            )
+        report = backups.restore_snapshot(snapshot, target)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    echo_backup_report("Restored", report)
+
+
+@cli.command()
+@click.argument("file", type=click.File(), default="-")
+def batch(file):
+    """Runs the admin command on each line of FILE (or stdin) in one session"""
+    run_session(file)
+
+
+@cli.command()
+def shell():
+    """Interactive prompt running admin commands in one session"""
+
+    def prompt_lines():
+        while True:
+            try:
+                yield input("gtb> ")
+            except EOFError:
+                click.echo()
+                return
+
+    click.echo("Admin commands without the admin.py prefix, exit to quit")
+    run_session(prompt_lines())
+
+
+def run_session(lines):
+    start = time.perf_counter()
+    commands = failed = 0
+
+    with AdminSession():
+        for line in lines:
+            args = shlex.split(line, comments=True)
+            if not args:
+                continue
+            if args[0] in ("exit", "quit"):
+                break
+
+            commands += 1
+            if args[0] in ("batch", "shell"):
+                click.echo(f"{args[0]} can not be run inside a session", err=True)
+                failed += 1
+                continue
+
+            try:
+                cli.main(args, prog_name="admin.py", standalone_mode=False)
+            except click.ClickException as e:
+                e.show()
+                failed += 1
+            except click.Abort:
+                failed += 1
+            except Exception:
+                logger.exception("Command failed: {}", line.strip())
+                failed += 1
+
+    click.echo(
+        f"{commands} commands ({failed} failed) in {time.perf_counter() - start:.2f}s",
+        err=True,
+    )
+
+
 async def get_discord_name(user_id: int):
     async with get_client() as client:
         u = await client.fetch_user(user_id)
@@ -276,19 +788,34 @@ async def get_discord_name(user_id: int):
     return u.global_name
 
 
-async def get_discord_member_name(
-    user_id: int, server_id: int = int(os.getenv("SERVER_ID"))
-):
-    async with get_client() as client:
-        m = await client.fetch_member(guild=server_id, user=user_id)
+async def get_discord_member_name(user_id: int, server_id: int):
+    key = (int(server_id), int(user_id))
+    if key not in session.member_names:
+        async with get_client() as client:
+            m = await client.fetch_member(guild=server_id, user=user_id)
+        session.member_names[key] = m.display_name
 
-    return m.display_name
+    return session.member_names[key]
 
 
-async def print_model(model: BaseModel, user_id: int, name: bool = False):
+async def get_discord_member_names(
+    user_ids: list[int], server_id: int, name: bool = True
+) -> list[str | None]:
+    """Display names of the members, fetched concurrently, or None if not name"""
+    if not name:
+        return [None] * len(user_ids)
+
+    return await asyncio.gather(
+        *(get_discord_member_name(user_id, server_id) for user_id in user_ids)
+    )
+
+
+async def print_model(
+    model: BaseModel, guild_id: int, user_id: int, name: bool = False
+):
     user_name = None
     if name:
-        user_name = await get_discord_member_name(user_id)
+        user_name = await get_discord_member_name(user_id, server_id=guild_id)
 
     click.echo(f"Name={user_name or 'excluded'} {model.model_dump_json()}")
 
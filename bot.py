@@ -1,26 +1,45 @@
+import asyncio
 import os
 from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
 from textwrap import dedent
+from typing import Annotated
 
 import crescent
-import dotenv
 import hikari
 import rootpath
 from hikari import (
-    Intents,
     GuildMessageCreateEvent,
     Message,
     MessageCreateEvent,
     DMMessageCreateEvent,
+    GuildMessageUpdateEvent,
+    DMMessageUpdateEvent,
+    GuildMessageDeleteEvent,
+    DMMessageDeleteEvent,
+    GuildBulkMessageDeleteEvent,
     MessageFlag,
+    StartingEvent,
+    StoppingEvent,
+    UNDEFINED,
 )
 from loguru import logger
 
 from src import repository, service
-from src.message_processing import process_message
+from src.backup import run_periodic_snapshots
+from src.gateway_cache import cache_settings, gateway_intents
+from src.journal import Journal, JournalConsumer, JournalEntry
+from src.logging_setup import configure_logging, sampled
+from src.message_processing import process_journal_entry
+from src.models import db_params
+from src.outbound import OutboundSender, Priority
+from src.ranking import streak_index
+from src.settings import settings
+from src.utils import Leaderboard, Period, period_key
+from src.watchdog import LoopWatchdog, label_task
 
 rootpath.append()
-dotenv.load_dotenv()
 
 
 @dataclass
@@ -29,30 +48,100 @@ class Model:
 
 
 bot = hikari.GatewayBot(
-    token=os.environ["TOKEN"],
-    intents=Intents.ALL_MESSAGES | Intents.MESSAGE_CONTENT | Intents.GUILDS,
+    token=settings.require_token(),
+    intents=gateway_intents(settings.cache_members),
+    cache_settings=cache_settings(settings.cache_profile, settings.cache_members),
 )
 
-client = crescent.Client(bot, Model())
+
+async def label_command_hook(ctx: crescent.Context) -> None:
+    name = " ".join(filter(None, (ctx.group, ctx.sub_group, ctx.command)))
+    label_task(f"command /{name}")
+
+
+client = crescent.Client(bot, Model(), command_hooks=[label_command_hook])
 
 model = Model()
 
+# Results channel of each guild and the channels accepted by the gateway
+# message filter, loaded once at startup
+guild_channels: dict[int, int] = {}
+gtg_channel_ids: frozenset[int] = frozenset()
+
+# Message events are journaled before they are applied to the database
+ingest: JournalConsumer | None = None
+
+# Messages the bot posts in channels and DMs, interaction responses go directly
+sender: OutboundSender | None = None
+
+backup_task: asyncio.Task | None = None
+
+
+def load_guild_channels():
+    global gtg_channel_ids
+
+    server_id, channel_id = settings.server_id, settings.gtg_channel_id
+    if server_id and channel_id and repository.get_guild(server_id) is None:
+        repository.set_guild_channel(server_id, channel_id)
+
+    guild_channels.clear()
+    for g in repository.get_all_guilds():
+        if g.channel_id:
+            guild_channels[g.guild_id] = g.channel_id
+    gtg_channel_ids = frozenset(guild_channels.values())
+
+    logger.info("Listening for results in {} channel(s)", len(gtg_channel_ids))
+
+
+async def start_ingest():
+    global ingest
+
+    journal = Journal(Path(rootpath.detect()) / "data" / settings.journal_file)
+    ingest = JournalConsumer(journal, process_journal_entry)
+    await ingest.start()
+
+
+async def start_sender():
+    global sender
+
+    sender = OutboundSender(bot.rest)
+    sender.start()
+
+
+def resolve_guild_id(ctx: crescent.Context) -> int | None:
+    if ctx.guild_id is not None:
+        return int(ctx.guild_id)
+
+    # Commands used in DMs act on the first guild the player is registered in
+    guild_ids = service.get_result_guilds(ctx.user.id)
+    return guild_ids[0] if guild_ids else None
+
+
+async def get_member_name(guild_id: int, user_id: int) -> str:
+    # Only found in the cache when guild members are cached
+    member = bot.cache.get_member(guild_id, user_id)
+    if member is None:
+        member = await client.app.rest.fetch_member(guild=guild_id, user=user_id)
+    return member.display_name
+
 
 async def check_player_exists_hook(ctx: crescent.Context) -> crescent.HookResult:
-    not_exists = not repository.player_exists(ctx.user.id)
+    guild_id = resolve_guild_id(ctx)
+    not_exists = guild_id is None or not repository.player_exists(guild_id, ctx.user.id)
     if not_exists:
         logger.info("Player not registered, terminating further interaction")
+        channel_id = guild_channels.get(guild_id)
         await ctx.respond(
             ephemeral=True,
-            content=f"Du är inte registrerad som spelare, posta ett resultat i <#{os.getenv('GTG_CHANNEL_ID')}> för "
-            f"att registrera dig",
+            content=f"Du är inte registrerad som spelare, posta ett resultat i "
+            f"{f'<#{channel_id}>' if channel_id else 'resultatkanalen'} för att registrera dig",
             ensure_message=True,
         )
     return crescent.HookResult(exit=not_exists)
 
 
 async def set_response_visibility_hook(ctx: crescent.Context) -> None:
-    is_hidden = not service.is_player_visible(ctx.user.id)
+    is_hidden = not service.is_player_visible(resolve_guild_id(ctx), ctx.user.id)
     if is_hidden:
         logger.info(
             "Player with user id {} is invisible, response will be hidden",
@@ -70,7 +159,7 @@ gtb_group = crescent.Group("gtb")
 @crescent.hook(check_player_exists_hook)
 @crescent.command(name="synlighet", description="Var synlig/osynlig på topplistor.")
 async def toggle_visibility(ctx: crescent.Context) -> None:
-    is_visible = service.toggle_player_visible(ctx.user.id)
+    is_visible = service.toggle_player_visible(resolve_guild_id(ctx), ctx.user.id)
 
     if is_visible:
         msg = "Du är nu synlig på topplistor."
@@ -85,7 +174,7 @@ async def toggle_visibility(ctx: crescent.Context) -> None:
 @crescent.hook(check_player_exists_hook)
 @crescent.command(name="deltagande", description="Dina resultat sparas/sparas ej.")
 async def toggle_active(ctx: crescent.Context) -> None:
-    is_active = service.toggle_player_active(ctx.user.id)
+    is_active = service.toggle_player_active(resolve_guild_id(ctx), ctx.user.id)
 
     if is_active:
         msg = "Du har nu registrerat dig. Dina resultat sparas."
@@ -104,14 +193,16 @@ async def stats(ctx: crescent.Context) -> None:
     user_id = 0
     name = ""
     # Check if message is in DM. If None this is a DM.
-    if ctx.channel is None:
+    if ctx.guild_id is None:
         user_id = ctx.user.id
         name = "dig"
     else:
         user_id = ctx.member.id
         name = ctx.member.display_name
 
-    pt = repository.get_player_total(user_id, "gtg")
+    guild_id = resolve_guild_id(ctx)
+    pt = repository.get_player_total(guild_id, user_id, "gtg")
+    rank = await asyncio.to_thread(streak_index.rank, guild_id, user_id)
     if pt:
         msg = f"""\
             ### Stats för *{name}*:
@@ -122,6 +213,7 @@ async def stats(ctx: crescent.Context) -> None:
             🟨 Nuvarande streak: {pt.current_streak}
             🟩 Bästa streak: {pt.max_streak}
             🟥 Värsta Streak: {pt.max_loosing_streak}
+            🏆 Placering: {f"{rank.position} av {rank.total}" if rank else "-"}
             📅 Första spel: {pt.join_date.strftime("%y-%m-%d")}
             """
     else:
@@ -142,39 +234,177 @@ async def missing(ctx: crescent.Context) -> None:
     dm_channel = await ctx.user.fetch_dm_channel()
 
     msg = ""
-    for gap in repository.get_gaps_in_results(ctx.user.id):
+    for gap in repository.get_gaps_in_results(resolve_guild_id(ctx), ctx.user.id):
         msg += (f"{gap[0]} - {gap[1]}" if type(gap) is tuple else gap) + os.linesep
 
-    await dm_channel.send(msg)
+    # Not awaited, the interaction is answered before the DM channel's limit
+    sender.send(dm_channel.id, msg, Priority.INTERACTION)
 
     await ctx.respond(
         "Saknade resultat skickade i dm", ephemeral=True, ensure_message=True
     )
 
 
+leaderboard_names = {
+    Leaderboard.CURRENT_STREAK: "Streak",
+    Leaderboard.MAX_STREAK: "Bästa streak",
+    Leaderboard.WIN_RATE: "Vinstandel",
+    Leaderboard.AVERAGE_GUESSES: "Snitt gissningar",
+    Leaderboard.PLAYED_GAMES: "Spelade",
+}
+
+
 @client.include
 @gtb_group.child
-@crescent.command(name="vemärkungen", description="Visar streak-topplistan.")
-async def top_streak(ctx: crescent.Context) -> None:
-    streak_chart = service.generate_streak_chart()
+@crescent.command(name="vemärkungen", description="Visar topplistan.")
+async def top_streak(
+    ctx: crescent.Context,
+    typ: Annotated[
+        str,
+        crescent.Description("Vad topplistan rankar"),
+        crescent.Choices(
+            *(
+                hikari.CommandChoice(name=name, value=leaderboard)
+                for leaderboard, name in leaderboard_names.items()
+            )
+        ),
+    ] = Leaderboard.CURRENT_STREAK,
+) -> None:
+    guild_id = resolve_guild_id(ctx)
+    if guild_id is None:
+        await ctx.respond("Hittar ingen topplista för dig.", ensure_message=True)
+        return
+
+    leaderboard = Leaderboard(typ)
+    chart = service.generate_leaderboard(guild_id, leaderboard)
     msg = ""
-    for index, sc in enumerate(streak_chart):
-        member = await client.app.rest.fetch_member(
-            guild=int(os.getenv("SERVER_ID")), user=sc.user_id
-        )
+    for index, entry in enumerate(chart):
+        member_name = await get_member_name(guild_id, entry.user_id)
+        value = service.format_leaderboard_value(leaderboard, entry.value)
         msg = (
             msg
-            + f"{index}. *Streak: {sc.current_streak}* | **{member.display_name}**"
+            + f"{index}. *{leaderboard_names[leaderboard]}: {value}* | **{member_name}**"
             + os.linesep
         )
 
+    await ctx.respond(content=msg or "Topplistan är tom.", ensure_message=True)
+
+
+async def respond_period_chart(ctx: crescent.Context, period: Period, title: str):
+    guild_id = resolve_guild_id(ctx)
+    if guild_id is None:
+        await ctx.respond("Hittar ingen topplista för dig.", ensure_message=True)
+        return
+
+    chart = repository.get_period_chart(guild_id, period, date.today())
+    msg = f"### {title} {period_key(period, date.today())}" + os.linesep
+    for index, pt in enumerate(chart):
+        member_name = await get_member_name(guild_id, pt.user_id)
+        msg += (
+            f"{index}. *Vunna: {pt.won} av {pt.played}* | Gissningar: {pt.total_guesses}"
+            f" | Bästa streak: {pt.max_streak} | **{member_name}**" + os.linesep
+        )
+    if not chart:
+        msg += "Inga resultat ännu."
+
     await ctx.respond(content=msg, ensure_message=True)
 
 
+@client.include
+@gtb_group.child
+@crescent.command(name="månad", description="Visar månadens topplista.")
+async def month_chart(ctx: crescent.Context) -> None:
+    await respond_period_chart(ctx, Period.MONTH, "Månadens topplista")
+
+
+@client.include
+@gtb_group.child
+@crescent.command(name="vecka", description="Visar veckans topplista.")
+async def week_chart(ctx: crescent.Context) -> None:
+    await respond_period_chart(ctx, Period.WEEK, "Veckans topplista")
+
+
+@client.include
+@gtb_group.child
+@crescent.hook(check_player_exists_hook)
+@crescent.hook(set_response_visibility_hook)
+@crescent.command(name="fördelning", description="Visar fördelningen av gissningar.")
+async def guess_distribution(
+    ctx: crescent.Context,
+    vem: Annotated[
+        str,
+        crescent.Description("Dina resultat eller hela serverns"),
+        crescent.Choices(
+            hikari.CommandChoice(name="Dina", value="player"),
+            hikari.CommandChoice(name="Servern", value="guild"),
+        ),
+    ] = "player",
+) -> None:
+    guild_id = resolve_guild_id(ctx)
+    if vem == "guild":
+        distribution = repository.get_guess_distribution(guild_id)
+        title = "Serverns gissningar"
+    else:
+        distribution = repository.get_guess_distribution(guild_id, ctx.user.id)
+        title = "Dina gissningar"
+
+    if not distribution.played:
+        await ctx.respond("Hittar inga resultat.", ephemeral=True, ensure_message=True)
+        return
+
+    bars = service.format_guess_distribution(distribution)
+    msg = f"### {title} ({distribution.played} spel)" + os.linesep
+    msg += f"```{os.linesep}{bars}{os.linesep}```"
+    await ctx.respond(ephemeral=model.response_hidden, content=msg, ensure_message=True)
+
+
+@client.include()
+@crescent.event
+async def on_starting(event: StartingEvent) -> None:
+    load_guild_channels()
+    for guild_id in guild_channels:
+        await asyncio.to_thread(streak_index.load, guild_id)
+    await asyncio.to_thread(repository.load_recent_results)
+    await start_ingest()
+    await start_sender()
+
+    if settings.loop_watchdog_ms:
+        LoopWatchdog(threshold=settings.loop_watchdog_ms / 1000).start()
+
+    if settings.backup_interval_minutes and settings.db_provider == "sqlite":
+        start_backups()
+
+
+def start_backups():
+    global backup_task
+
+    source = Path(db_params["filename"])
+    backup_task = asyncio.create_task(
+        run_periodic_snapshots(
+            source,
+            source.parent / settings.backup_dir,
+            settings.backup_interval_minutes * 60,
+            settings.backup_keep,
+        ),
+        name="periodic-backup",
+    )
+
+
+@client.include()
+@crescent.event
+async def on_stopping(event: StoppingEvent) -> None:
+    if ingest:
+        await ingest.stop()
+    if sender:
+        await sender.stop()
+    if backup_task:
+        backup_task.cancel()
+
+
 @client.include()
 @crescent.event
-async def on_message_create(event: GuildMessageCreateEvent) -> None:
-    if event.channel_id != int(os.environ["GTG_CHANNEL_ID"]):
+async def on_guild_message_create(event: GuildMessageCreateEvent) -> None:
+    if event.channel_id not in gtg_channel_ids:
         return
 
     await guess_message_event_handler(event)
@@ -182,7 +412,7 @@ async def on_message_create(event: GuildMessageCreateEvent) -> None:
 
 @client.include()
 @crescent.event
-async def on_message_create(event: DMMessageCreateEvent):
+async def on_dm_message_create(event: DMMessageCreateEvent):
     await guess_message_event_handler(event)
 
 
@@ -193,18 +423,13 @@ async def guess_message_event_handler(
         return
 
     event_type = type(event)
+    label_task(f"{event_type.__name__} {event.message.id}")
 
-    channel_name = (
-        "GTG-Channel"
-        if int(event.channel_id) == int(os.getenv("GTG_CHANNEL_ID"))
-        else event.channel_id
-    )
-
-    logger.debug(
+    sampled(100).debug(
         "Author {} posted message with id {} {}",
         event.author_id,
         event.message.id,
-        f"on channel {channel_name}"
+        f"on GTG-Channel of guild {event.guild_id}"
         if event_type is GuildMessageCreateEvent
         else "as as a DM",
     )
@@ -214,24 +439,111 @@ async def guess_message_event_handler(
     if msg.content is None:
         return
 
-    if repository.player_exists(msg.author.id) and not service.is_player_active(
-        msg.author.id
-    ):
-        logger.debug(
-            "Player with user id {} has opted out of result saving.", msg.author.id
+    res = await ingest.submit(
+        JournalEntry(
+            message_id=int(msg.id),
+            channel_id=int(msg.channel_id),
+            guild_id=msg.guild_id,
+            author_id=int(msg.author.id),
+            content=msg.content,
         )
+    )
+
+    if res and event_type is DMMessageCreateEvent:
+        for r in res:
+            sender.send(msg.channel_id, r.message)
+
+
+@client.include()
+@crescent.event
+async def on_guild_message_update(event: GuildMessageUpdateEvent) -> None:
+    if event.channel_id not in gtg_channel_ids:
+        return
+
+    await guess_message_edit_handler(event)
+
+
+@client.include()
+@crescent.event
+async def on_dm_message_update(event: DMMessageUpdateEvent) -> None:
+    await guess_message_edit_handler(event)
+
+
+async def guess_message_edit_handler(
+    event: GuildMessageUpdateEvent | DMMessageUpdateEvent,
+):
+    # Content is undefined when only embeds or flags of the message changed
+    if event.content is UNDEFINED or event.is_human is not True:
         return
 
-    res = process_message(
-        message_content=msg.content,
-        message_id=int(msg.id),
-        author_id=int(msg.author.id),
+    event_type = type(event)
+    label_task(f"{event_type.__name__} {event.message_id}")
+
+    author_id = int(event.author_id)
+    logger.debug("Author {} edited message with id {}", author_id, event.message_id)
+
+    res = await ingest.submit(
+        JournalEntry(
+            kind="update",
+            message_id=int(event.message_id),
+            channel_id=int(event.channel_id),
+            guild_id=event.message.guild_id,
+            author_id=author_id,
+            content=event.content or "",
+        )
     )
 
-    if res and event_type is DMMessageCreateEvent:
+    if res and event_type is DMMessageUpdateEvent:
         for r in res:
-            await msg.respond(content=r.message)
+            sender.send(event.channel_id, r.message)
+
+
+@client.include()
+@crescent.event
+async def on_guild_message_delete(event: GuildMessageDeleteEvent) -> None:
+    if event.channel_id not in gtg_channel_ids:
+        return
+
+    label_task(f"GuildMessageDeleteEvent {event.message_id}")
+    await journal_message_delete(event.message_id, event.channel_id, event.guild_id)
+
+
+@client.include()
+@crescent.event
+async def on_dm_message_delete(event: DMMessageDeleteEvent) -> None:
+    label_task(f"DMMessageDeleteEvent {event.message_id}")
+    await journal_message_delete(event.message_id, event.channel_id)
+
+
+@client.include()
+@crescent.event
+async def on_guild_bulk_message_delete(event: GuildBulkMessageDeleteEvent) -> None:
+    if event.channel_id not in gtg_channel_ids:
+        return
+
+    await asyncio.gather(
+        *(
+            journal_message_delete(message_id, event.channel_id, event.guild_id)
+            for message_id in event.message_ids
+        )
+    )
+
+
+async def journal_message_delete(
+    message_id: hikari.Snowflake,
+    channel_id: hikari.Snowflake,
+    guild_id: hikari.Snowflake | None = None,
+):
+    await ingest.submit(
+        JournalEntry(
+            kind="delete",
+            message_id=int(message_id),
+            channel_id=int(channel_id),
+            guild_id=guild_id,
+        )
+    )
 
 
 if __name__ == "__main__":
+    configure_logging(settings.log_level)
     bot.run()
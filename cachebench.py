@@ -0,0 +1,178 @@
+"""Memory footprint of the gateway cache profiles under synthetic events.
+
+Feeds generated MESSAGE_CREATE and GUILD_MEMBERS_CHUNK payloads through
+hikari's event manager of a bot configured with each cache profile, the same
+path gateway events take, and reports what is left in the cache. Each profile
+runs in a process of its own so the resident sizes can be compared.
+"""
+import asyncio
+import multiprocessing
+import random
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import click
+
+
+def resident_kib() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def user_payload(user_id: int) -> dict:
+    return {
+        "id": str(user_id),
+        "username": f"spelare{user_id % 100000}",
+        "global_name": f"Spelare {user_id % 100000}",
+        "discriminator": "0",
+        "avatar": "a" * 32,
+    }
+
+
+def member_payload(user_id: int, joined_at: str) -> dict:
+    return {
+        "user": user_payload(user_id),
+        "nick": None,
+        "roles": [str(user_id + 1)],
+        "joined_at": joined_at,
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def message_payload(
+    message_id: int, guild_id: int, channel_id: int, user_id: int, now: str
+) -> dict:
+    member = member_payload(user_id, now)
+    del member["user"]
+    return {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "guild_id": str(guild_id),
+        "author": user_payload(user_id),
+        "member": member,
+        "content": "#GuessTheGame #1000\n\n🎮 🟥 🟥 🟨 🟩 ⬜ ⬜\n\n#ProudGamer",
+        "timestamp": now,
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0,
+    }
+
+
+async def feed(messages: int, users: int, members: int, profile: str, cache_members):
+    import hikari
+
+    from src.gateway_cache import cache_settings, gateway_intents
+
+    bot = hikari.GatewayBot(
+        token="cachebench",
+        intents=gateway_intents(cache_members),
+        cache_settings=cache_settings(profile, cache_members),
+        banner=None,
+    )
+    guild_id, channel_id = 1 << 40, 2 << 40
+    user_ids = [10**17 + i for i in range(max(users, members))]
+    now = datetime.now(timezone.utc)
+    timestamp = now.isoformat()
+
+    tracemalloc.start()
+    start_rss = resident_kib()
+
+    chunk_size = 1000
+    chunks = range(0, members, chunk_size)
+    for index, offset in enumerate(chunks):
+        bot.event_manager.consume_raw_event(
+            "GUILD_MEMBERS_CHUNK",
+            None,
+            {
+                "guild_id": str(guild_id),
+                "members": [
+                    member_payload(user_id, timestamp)
+                    for user_id in user_ids[offset : offset + chunk_size]
+                ],
+                "chunk_index": index,
+                "chunk_count": len(chunks),
+            },
+        )
+        await asyncio.sleep(0)
+
+    for i in range(messages):
+        sent = now + timedelta(seconds=i)
+        message_id = int(hikari.Snowflake.from_datetime(sent)) + i
+        bot.event_manager.consume_raw_event(
+            "MESSAGE_CREATE",
+            None,
+            message_payload(
+                message_id,
+                guild_id,
+                channel_id,
+                random.choice(user_ids[:users]),
+                sent.isoformat(),
+            ),
+        )
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+
+    # Every event is handled in a task of its own
+    while len(asyncio.all_tasks()) > 1:
+        await asyncio.sleep(0)
+
+    traced, _ = tracemalloc.get_traced_memory()
+    return {
+        "traced_kib": traced // 1024,
+        "rss_kib": resident_kib() - start_rss,
+        "messages": len(bot.cache.get_messages_view()),
+        "users": len(bot.cache.get_users_view()),
+        "members": sum(len(m) for m in bot.cache.get_members_view().values()),
+    }
+
+
+def run_profile(args) -> dict:
+    random.seed(0)
+    return asyncio.run(feed(*args))
+
+
+@click.command()
+@click.option("-m", "--messages", type=int, default=20000, show_default=True)
+@click.option("-u", "--users", type=int, default=500, show_default=True)
+@click.option(
+    "--members",
+    type=int,
+    default=5000,
+    show_default=True,
+    help="Guild members sent in member chunks",
+)
+def cachebench(messages, users, members):
+    """Reports cache size after a burst of gateway events for each profile."""
+    profiles = [
+        ("default", False),
+        ("results", False),
+        ("results", True),
+    ]
+    context = multiprocessing.get_context("spawn")
+    for profile, cache_members in profiles:
+        with context.Pool(1) as pool:
+            res = pool.apply(
+                run_profile, ((messages, users, members, profile, cache_members),)
+            )
+        name = profile + (" + members" if cache_members else "")
+        click.echo(
+            f"{name:18} rss +{res['rss_kib'] / 1024:6.1f} MiB"
+            f" traced {res['traced_kib'] / 1024:6.1f} MiB |"
+            f" cached messages {res['messages']}, users {res['users']},"
+            f" members {res['members']}"
+        )
+
+
+if __name__ == "__main__":
+    cachebench()
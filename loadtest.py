@@ -0,0 +1,353 @@
+"""Offline load generator for the bot's gateway and slash command handlers.
+
+Builds fake message create events with GuessThe.Game results, drives the real
+handlers against a separate database with a stubbed REST client and reports
+handler latency, event loop lag and database commits. The database provider is
+taken from the settings, so the same run can be made against SQLite and
+PostgreSQL (DB_PROVIDER=postgres with a DB_NAME containing "loadtest").
+"""
+import asyncio
+import os
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import click
+import rootpath
+
+os.environ.setdefault("TOKEN", "loadtest")
+
+SQUARES = ["🟥", "🟨"]
+
+
+@dataclass
+class StubRest:
+    """Stands in for hikari's REST client and counts the calls made."""
+
+    calls: int = 0
+    messages: int = 0
+
+    async def create_message(self, channel, content=None, **kwargs):
+        self.calls += 1
+        self.messages += 1
+
+    async def fetch_member(self, guild, user):
+        self.calls += 1
+        return FakeMember(id=user, display_name=f"Spelare {user}")
+
+
+@dataclass
+class FakeUser:
+    id: int
+    rest: StubRest
+    is_bot: bool = False
+    is_system: bool = False
+
+    async def fetch_dm_channel(self):
+        return FakeChannel(id=self.id, rest=self.rest)
+
+
+@dataclass
+class FakeMember:
+    id: int
+    display_name: str
+
+
+@dataclass
+class FakeChannel:
+    id: int
+    rest: StubRest
+
+    async def send(self, content=None, **kwargs):
+        self.rest.calls += 1
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    channel_id: int
+    guild_id: int | None
+    author: FakeUser
+    content: str
+    rest: StubRest
+    member: FakeMember | None = None
+    webhook_id: int | None = None
+
+    async def respond(self, content=None, **kwargs):
+        self.rest.calls += 1
+
+
+@dataclass
+class FakeContext:
+    user: FakeUser
+    member: FakeMember | None
+    channel: FakeChannel | None
+    guild_id: int | None
+    rest: StubRest
+    responses: list = field(default_factory=list)
+
+    async def respond(self, content=None, **kwargs):
+        self.rest.calls += 1
+        self.responses.append(content or kwargs.get("content"))
+
+
+def gtg_content(round_id: int, undated_share: float = 0.1) -> str:
+    """A random GuessThe.Game result, a share of them without the round number."""
+    guesses = random.randint(0, 6)
+    squares = [random.choice(SQUARES) for _ in range(6)]
+    if guesses:
+        squares[guesses - 1] = "🟩"
+        squares[guesses:] = ["⬜"] * (6 - guesses)
+    undated = undated_share and random.random() < undated_share
+    tag = "#GuessTheGame" if undated else f"#GuessTheGame #{round_id}"
+    return f"{tag}\n\n🎮 {' '.join(squares)}\n\n#ProudGamer"
+
+
+def percentiles(samples: list[float]) -> str:
+    if len(samples) < 2:
+        return "n/a"
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return (
+        " ".join(f"p{p}={cuts[p - 1] * 1000:.1f}ms" for p in (50, 95, 99))
+        + f" max={max(samples) * 1000:.1f}ms"
+    )
+
+
+async def measure_loop_lag(lag_samples: list[float], interval: float = 0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag_samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+@click.command()
+@click.option("-m", "--messages", type=int, default=100, show_default=True)
+@click.option(
+    "-r",
+    "--rate",
+    type=float,
+    default=100 / 60,
+    show_default=True,
+    help="Messages per second",
+)
+@click.option("-u", "--users", type=int, default=100, show_default=True)
+@click.option(
+    "--dm-share",
+    type=float,
+    default=0.2,
+    show_default=True,
+    help="Share of results posted as DMs to the bot",
+)
+@click.option(
+    "--rounds",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Results of consecutive rounds shared in each message",
+)
+@click.option(
+    "-c",
+    "--commands",
+    type=int,
+    default=20,
+    show_default=True,
+    help="Slash commands of each kind run after the burst",
+)
+@click.option("--db-file", default="loadtest.db", show_default=True)
+@click.option(
+    "--keep-db", is_flag=True, help="Reuse results from an earlier run, else drop them"
+)
+@click.option("-s", "--seed", type=int, default=0, show_default=True)
+@click.option("--log-level", default="WARNING", show_default=True)
+@click.option(
+    "--watchdog-ms", type=int, help="Report handlers blocking the loop this long"
+)
+def loadtest(
+    messages,
+    rate,
+    users,
+    dm_share,
+    rounds,
+    commands,
+    db_file,
+    keep_db,
+    seed,
+    log_level,
+    watchdog_ms,
+):
+    """Simulates a burst of result postings against the bot handlers."""
+    from src.logging_setup import configure_logging
+
+    random.seed(seed)
+    configure_logging(log_level)
+
+    (Path(rootpath.detect()) / "data").mkdir(exist_ok=True)
+    os.environ["DB_FILE"] = db_file
+    os.environ["JOURNAL_FILE"] = f"{Path(db_file).stem}.journal"
+
+    from src.settings import settings
+
+    if (
+        settings.db_provider == "postgres"
+        and not keep_db
+        and "loadtest" not in settings.db_name
+    ):
+        raise click.UsageError("Refusing to drop tables outside a loadtest database")
+
+    asyncio.run(
+        run(messages, rate, users, dm_share, rounds, commands, watchdog_ms, keep_db)
+    )
+
+
+async def run(messages, rate, users, dm_share, rounds, commands, watchdog_ms, keep_db):
+    # Imported here so the bot binds to the load test database
+    from pony.orm import db_session
+
+    import bot
+    from src import models, repository
+    from src.message_processing import gtg_first_date
+    from src.settings import settings
+    from src.watchdog import LoopWatchdog
+
+    if not keep_db:
+        models.db.drop_all_tables(with_all_data=True)
+        models.db.create_tables()
+
+    with db_session:
+        if models.GameType.select().first() is None:
+            models.populate_database()
+
+    guild_id, channel_id = bot.hikari.Snowflake(1 << 40), bot.hikari.Snowflake(2 << 40)
+    repository.set_guild_channel(guild_id, channel_id)
+    bot.load_guild_channels()
+
+    if not keep_db:
+        for path in (Path(rootpath.detect()) / "data").glob(
+            f"{settings.journal_file}*"
+        ):
+            path.unlink()
+    repository.load_recent_results()
+    await bot.start_ingest()
+
+    rest = StubRest()
+    bot.bot._rest = rest
+    await bot.start_sender()
+
+    commits = 0
+    provider_commit = models.db.provider.commit
+
+    def counting_commit(*args, **kwargs):
+        nonlocal commits
+        commits += 1
+        return provider_commit(*args, **kwargs)
+
+    models.db.provider.commit = counting_commit
+
+    now = datetime.now(timezone.utc)
+    round_id = (now.date() - gtg_first_date).days + 1
+    user_ids = [random.randint(10**17, 10**18) for _ in range(users)]
+    dm_results = 0
+
+    def make_event(index: int):
+        user = FakeUser(id=random.choice(user_ids), rest=rest)
+        sent = now + timedelta(milliseconds=index)
+        dm = random.random() < dm_share
+        if dm:
+            nonlocal dm_results
+            dm_results += rounds
+        first_round = round_id - rounds + 1 - random.randint(0, 3)
+        message = FakeMessage(
+            id=bot.hikari.Snowflake(
+                int(bot.hikari.Snowflake.from_datetime(sent)) + index
+            ),
+            channel_id=user.id if dm else channel_id,
+            guild_id=None if dm else guild_id,
+            author=user,
+            member=None if dm else FakeMember(id=user.id, display_name=str(user.id)),
+            content="\n\n".join(
+                gtg_content(first_round + offset) for offset in range(rounds)
+            ),
+            rest=rest,
+        )
+        event_type = bot.DMMessageCreateEvent if dm else bot.GuildMessageCreateEvent
+        return event_type(message=message, shard=None)
+
+    async def timed(coro, samples: list[float]):
+        start = time.perf_counter()
+        await coro
+        samples.append(time.perf_counter() - start)
+
+    lag_samples = list[float]()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples))
+    if watchdog_ms:
+        watchdog = LoopWatchdog(threshold=watchdog_ms / 1000, interval=0.005)
+        watchdog.start()
+
+    handler_samples = list[float]()
+    tasks = []
+    start = time.perf_counter()
+    for i in range(messages):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        event = make_event(i)
+        handler = (
+            bot.on_guild_message_create
+            if type(event) is bot.GuildMessageCreateEvent
+            else bot.on_dm_message_create
+        ).metadata
+        # hikari dispatches every event in its own task
+        tasks.append(asyncio.create_task(timed(handler(event), handler_samples)))
+    await asyncio.gather(*tasks)
+    burst_time = time.perf_counter() - start
+    await bot.sender.flush()
+    burst_commits, burst_rest_calls = commits, rest.calls
+    burst_replies = rest.messages
+
+    command_samples = dict[str, list[float]]()
+    players = [p.user_id for p in repository.get_all_players(guild_id)]
+    for command in (bot.stats, bot.missing, bot.top_streak):
+        samples = command_samples.setdefault(command.metadata.app_command.name, [])
+        for user_id in random.sample(players, min(commands, len(players))):
+            user = FakeUser(id=user_id, rest=rest)
+            ctx = FakeContext(
+                user=user,
+                member=FakeMember(id=user_id, display_name=str(user_id)),
+                channel=FakeChannel(id=channel_id, rest=rest),
+                guild_id=guild_id,
+                rest=rest,
+            )
+            # The undecorated command, crescent hooks expect a real context
+            await timed(command.metadata.owner(ctx), samples)
+
+    lag_task.cancel()
+    await bot.ingest.stop()
+    await bot.sender.stop()
+    if watchdog_ms:
+        watchdog.stop()
+
+    click.echo(f"provider: {models.db.provider_name}")
+    click.echo(
+        f"{messages} messages from {users} users in {burst_time:.1f}s "
+        f"({messages / burst_time:.1f} msg/s)"
+    )
+    click.echo(f"handler latency: {percentiles(handler_samples)}")
+    click.echo(f"event loop lag: {percentiles(lag_samples)}")
+    click.echo(
+        f"db commits: {burst_commits} during burst "
+        f"({burst_commits / messages:.2f} per message), {commits} in total"
+    )
+    click.echo(f"rest calls: {burst_rest_calls} during burst, {rest.calls} in total")
+    click.echo(
+        f"dm replies: {burst_replies} messages sent for {dm_results} results"
+        f" ({burst_replies / max(1, dm_results):.2f} per result)"
+    )
+    for name, samples in command_samples.items():
+        click.echo(f"/gtb {name}: {percentiles(samples)}")
+
+
+if __name__ == "__main__":
+    loadtest()
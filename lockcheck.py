@@ -0,0 +1,140 @@
+"""Concurrent reads and writes against SQLite without "database is locked".
+
+Applies generated result postings through process_journal_entry on one
+thread, the path the ingest consumer takes, while reader threads run the
+reporting queries of the stats, chart and leaderboard commands against the
+same scratch database. Every failed call is counted, a "database is locked"
+error means a read contended with a commit instead of going through the
+read-only connection.
+"""
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import click
+import rootpath
+
+from loadtest import gtg_content
+
+
+@click.command()
+@click.option("-m", "--messages", type=int, default=2000, show_default=True)
+@click.option("-u", "--users", type=int, default=50, show_default=True)
+@click.option("-r", "--readers", type=int, default=4, show_default=True)
+@click.option("--db-file", default="lockcheck.db", show_default=True)
+@click.option("--keep-db", is_flag=True, help="Keep the database after the run")
+@click.option("-s", "--seed", type=int, default=0, show_default=True)
+def lockcheck(messages, users, readers, db_file, keep_db, seed):
+    """Reports errors of reads made while results are written."""
+    random.seed(seed)
+    data = Path(rootpath.detect()) / "data"
+    data.mkdir(exist_ok=True)
+    os.environ["DB_FILE"] = db_file
+    os.environ["DB_PROVIDER"] = "sqlite"
+
+    # Imported here so the models bind to the scratch database
+    from datetime import datetime, timezone
+
+    import hikari
+    from loguru import logger
+
+    from src import models, repository, service
+    from src.journal import JournalEntry
+    from src.message_processing import gtg_first_date, process_journal_entry
+    from src.utils import Leaderboard
+
+    logger.remove()
+    models.db.drop_all_tables(with_all_data=True)
+    models.db.create_tables()
+    models.populate_database()
+    guild_id, channel_id = 1 << 40, 2 << 40
+    repository.set_guild_channel(guild_id, channel_id)
+
+    now = datetime.now(timezone.utc)
+    last_round = (now.date() - gtg_first_date).days + 1
+    user_ids = [10**17 + i for i in range(users)]
+    entries = [
+        JournalEntry(
+            kind="create",
+            message_id=int(hikari.Snowflake.from_datetime(now)) + i,
+            channel_id=channel_id,
+            guild_id=guild_id,
+            author_id=random.choice(user_ids),
+            content=gtg_content(
+                last_round - i % (messages // users + 1), undated_share=0
+            ),
+        )
+        for i in range(messages)
+    ]
+
+    errors = Counter[str]()
+    latencies = list[float]()
+    writing = threading.Event()
+    writing.set()
+
+    def write():
+        for entry in entries:
+            try:
+                process_journal_entry(entry)
+            except Exception as e:
+                errors[f"write: {e}"] += 1
+        writing.clear()
+
+    def read(index: int):
+        reads = [
+            lambda user_id: repository.get_player_total(guild_id, user_id),
+            lambda user_id: repository.get_gaps_in_results(guild_id, user_id),
+            lambda user_id: repository.get_player_profile(guild_id, user_id),
+            lambda user_id: service.generate_streak_chart(guild_id),
+            lambda user_id: service.generate_leaderboard(
+                guild_id, random.choice(list(Leaderboard))
+            ),
+        ]
+        rng = random.Random(seed + index)
+        while writing.is_set():
+            start = time.perf_counter()
+            try:
+                rng.choice(reads)(rng.choice(user_ids))
+            except Exception as e:
+                errors[f"read: {e}"] += 1
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=write)] + [
+        threading.Thread(target=read, args=(i,)) for i in range(readers)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if not keep_db:
+        for path in data.glob(f"{db_file}*"):
+            path.unlink()
+
+    click.echo(
+        f"{messages} messages written in {elapsed:.2f}s"
+        f" ({messages / elapsed:.0f}/s) alongside {len(latencies)} reads"
+        f" on {readers} threads"
+    )
+    if latencies:
+        latencies.sort()
+        click.echo(
+            f"read latency p50 {statistics.median(latencies) * 1000:.1f} ms,"
+            f" p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms"
+        )
+    locked = sum(n for error, n in errors.items() if "database is locked" in error)
+    for error, n in errors.most_common():
+        click.echo(f"{n:6} {error}")
+    click.echo(f"{sum(errors.values())} errors, {locked} database is locked")
+    if locked:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    lockcheck()
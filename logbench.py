@@ -0,0 +1,132 @@
+"""Per-message cost of logging on the ingest path at INFO and DEBUG.
+
+Applies generated result postings through process_journal_entry, the path the
+ingest consumer takes, against a scratch SQLite database with the handler of
+src.logging_setup writing to a file. Time spent inside loguru calls on the
+applying thread is measured apart from the total, for a synchronous and an
+enqueued sink. Each configuration runs in a process of its own.
+"""
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import click
+import rootpath
+
+from loadtest import gtg_content
+
+
+def run_config(args) -> dict:
+    messages, users, level, enqueue, db_file, log_file = args
+    random.seed(0)
+    os.environ["DB_FILE"] = db_file
+    os.environ.setdefault("DB_PROVIDER", "sqlite")
+
+    from datetime import datetime, timezone
+
+    import hikari
+    from loguru._logger import Logger
+
+    from src import models, repository
+    from src.journal import JournalEntry
+    from src.logging_setup import close_logging, configure_logging
+    from src.message_processing import gtg_first_date, process_journal_entry
+
+    models.populate_database()
+    guild_id, channel_id = 1 << 40, 2 << 40
+    repository.set_guild_channel(guild_id, channel_id)
+
+    with open(log_file, "w") as sink:
+        configure_logging(level, stream=sink, enqueue=enqueue)
+
+        logged = 0.0
+        log = Logger._log
+
+        def timed_log(self, *args, **kwargs):
+            nonlocal logged
+            start = time.perf_counter()
+            try:
+                return log(self, *args, **kwargs)
+            finally:
+                logged += time.perf_counter() - start
+
+        Logger._log = timed_log
+
+        now = datetime.now(timezone.utc)
+        last_round = (now.date() - gtg_first_date).days + 1
+        user_ids = [10**17 + i for i in range(users)]
+        entries = [
+            JournalEntry(
+                kind="create",
+                message_id=int(hikari.Snowflake.from_datetime(now)) + i,
+                channel_id=channel_id,
+                guild_id=guild_id,
+                author_id=random.choice(user_ids),
+                content=gtg_content(
+                    last_round - i % (messages // users + 1), undated_share=0
+                ),
+            )
+            for i in range(messages)
+        ]
+
+        start = time.perf_counter()
+        for entry in entries:
+            process_journal_entry(entry)
+        elapsed = time.perf_counter() - start
+        Logger._log = log
+        close_logging()
+
+    return {
+        "total_us": elapsed / messages * 1e6,
+        "logging_us": logged / messages * 1e6,
+        "lines": sum(1 for _ in open(log_file)) / messages,
+    }
+
+
+@click.command()
+@click.option("-m", "--messages", type=int, default=2000, show_default=True)
+@click.option("-u", "--users", type=int, default=50, show_default=True)
+def logbench(messages, users):
+    """Reports the logging cost of each applied message at INFO and DEBUG."""
+    configs = [
+        ("INFO", False),
+        ("INFO", True),
+        ("DEBUG", False),
+        ("DEBUG", True),
+    ]
+    data = Path(rootpath.detect()) / "data"
+    data.mkdir(exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for index, (level, enqueue) in enumerate(configs):
+            db_file = f"logbench{index}.db"
+            with context.Pool(1) as pool:
+                res = pool.apply(
+                    run_config,
+                    (
+                        (
+                            messages,
+                            users,
+                            level,
+                            enqueue,
+                            db_file,
+                            str(Path(tmp) / f"{index}.log"),
+                        ),
+                    ),
+                )
+            for path in data.glob(f"{db_file}*"):
+                path.unlink()
+            name = f"{level} {'enqueued' if enqueue else 'sync'}"
+            click.echo(
+                f"{name:15} {res['total_us']:8.1f} us/message,"
+                f" logging {res['logging_us']:6.1f} us/message"
+                f" ({res['logging_us'] / res['total_us']:.1%}),"
+                f" {res['lines']:.2f} lines/message"
+            )
+
+
+if __name__ == "__main__":
+    logbench()
@@ -0,0 +1,102 @@
+"""Week and month totals stay in line with results posted out of order.
+
+Posts results of a span of rounds in a random order through
+process_journal_entry against a scratch SQLite database, so rounds are
+created after later ones as with late posts and backfills, then recomputes
+every player's statistics with the checks of the verify admin command and
+exits non-zero on a stored total that differs from the results.
+"""
+import os
+import random
+from pathlib import Path
+
+import click
+import rootpath
+
+from loadtest import gtg_content
+
+
+@click.command()
+@click.option("-r", "--rounds", type=int, default=60, show_default=True)
+@click.option("-u", "--users", type=int, default=4, show_default=True)
+@click.option(
+    "-p",
+    "--posted",
+    type=float,
+    default=0.4,
+    show_default=True,
+    help="Share of rounds each player posts",
+)
+@click.option("--db-file", default="periodcheck.db", show_default=True)
+@click.option("--keep-db", is_flag=True, help="Keep the database after the run")
+@click.option("-s", "--seed", type=int, default=0, show_default=True)
+def periodcheck(rounds, users, posted, db_file, keep_db, seed):
+    """Reports stored statistics that differ after posting rounds out of order."""
+    random.seed(seed)
+    data = Path(rootpath.detect()) / "data"
+    data.mkdir(exist_ok=True)
+    os.environ["DB_FILE"] = db_file
+    os.environ["DB_PROVIDER"] = "sqlite"
+
+    # Imported here so the models bind to the scratch database
+    from datetime import datetime, time, timedelta, timezone
+
+    import hikari
+    from loguru import logger
+
+    from src import models, repository, verify
+    from src.journal import JournalEntry
+    from src.message_processing import gtg_first_date, process_journal_entry
+
+    logger.remove()
+    models.db.drop_all_tables(with_all_data=True)
+    models.db.create_tables()
+    models.populate_database()
+    guild_id, channel_id = 1 << 40, 2 << 40
+    repository.set_guild_channel(guild_id, channel_id)
+
+    first_round = (datetime.now(timezone.utc).date() - gtg_first_date).days - rounds
+    user_ids = [10**17 + i for i in range(users)]
+    postings = [
+        (round_id, user_id)
+        for round_id in range(first_round, first_round + rounds)
+        for user_id in user_ids
+        if random.random() < posted
+    ]
+    random.shuffle(postings)
+
+    for index, (round_id, user_id) in enumerate(postings):
+        # Sent on the round's day, the submit time is read from the message id
+        sent = datetime.combine(
+            gtg_first_date + timedelta(days=round_id - 1), time(12), timezone.utc
+        )
+        process_journal_entry(
+            JournalEntry(
+                kind="create",
+                message_id=int(hikari.Snowflake.from_datetime(sent)) + index,
+                channel_id=channel_id,
+                guild_id=guild_id,
+                author_id=user_id,
+                content=gtg_content(round_id, undated_share=0),
+            )
+        )
+
+    mismatches, results = verify.verify_players(
+        [(guild_id, user_id) for user_id in user_ids]
+    )
+    if not keep_db:
+        for path in data.glob(f"{db_file}*"):
+            path.unlink()
+
+    for m in mismatches:
+        click.echo(f"[{m.check}] player {m.user_id}: {m.detail}")
+    click.echo(
+        f"{len(mismatches)} mismatches in {users} players and {results} results"
+        f" of {rounds} rounds posted out of order"
+    )
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    periodcheck()
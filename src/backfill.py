@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple
+
+import hikari
+from loguru import logger
+
+from src.outbound import RouteBucket
+
+PAGE_SIZE = 100
+
+
+class BackfillSource(NamedTuple):
+    channel_id: int
+    # None for a DM channel, its results go to each guild of the author
+    guild_id: int | None
+    label: str
+
+
+@dataclass
+class ChannelProgress:
+    source: BackfillSource
+    fetched: int = 0
+    requests: int = 0
+    last_timestamp: datetime | None = None
+    done: bool = False
+    error: str | None = None
+
+
+@dataclass
+class BackfillStats:
+    messages: int = 0
+    matched: int = 0
+    players_added: int = 0
+    games_added: int = 0
+    results_added: int = 0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def rate(self) -> float:
+        """Ingested messages per second."""
+        seconds = time.perf_counter() - self.started
+        return self.messages / seconds if seconds else 0.0
+
+
+class Backfill:
+    """Reads the history of several channels at once and ingests it in order.
+
+    Each channel is paged by a fetcher of its own while every request waits
+    for room in one window shared by all of them, kept under Discord's global
+    limit. Per route limits are left to the REST client. The pages are merged
+    by message id, so results are ingested in the order they were posted, as
+    the live bot would have seen them. A fetcher stays at most pages_ahead
+    pages ahead of the merge, a channel with far newer messages waits for the
+    others instead of filling memory.
+    """
+
+    def __init__(
+        self,
+        rest,
+        sources: list[BackfillSource],
+        after: int,
+        before: datetime | None = None,
+        rate: int = 40,
+        period: float = 1.0,
+        pages_ahead: int = 2,
+    ):
+        self.rest = rest
+        self.sources = sources
+        self.after = after
+        self.before = before
+        self.pages_ahead = pages_ahead
+        self.limiter = RouteBucket(rate, period)
+        self.progress = {s.channel_id: ChannelProgress(s) for s in sources}
+        self.stats = BackfillStats()
+
+    async def _fetch(
+        self, source: BackfillSource, pages: asyncio.Queue[list | None]
+    ) -> None:
+        progress = self.progress[source.channel_id]
+        after = self.after
+        try:
+            while True:
+                await self.limiter.acquire()
+                progress.requests += 1
+                page = sorted(
+                    await self.rest.fetch_messages(
+                        source.channel_id, after=after
+                    ).limit(PAGE_SIZE),
+                    key=lambda m: int(m.id),
+                )
+                if self.before is not None:
+                    page = [m for m in page if m.timestamp <= self.before]
+                if page:
+                    after = int(page[-1].id)
+                    progress.fetched += len(page)
+                    progress.last_timestamp = page[-1].timestamp
+                    await pages.put(page)
+                if len(page) < PAGE_SIZE:
+                    break
+        except hikari.HTTPError as e:
+            # A closed DM or a missing permission ends only that channel
+            progress.error = str(e)
+            logger.warning("Reading channel {} failed: {}", source.label, e)
+        except Exception as e:
+            progress.error = repr(e)
+            logger.exception("Reading channel {} failed", source.label)
+        progress.done = True
+        await pages.put(None)
+
+    async def messages(self) -> AsyncIterator[tuple[BackfillSource, hikari.Message]]:
+        """Messages of all sources, oldest first."""
+        queues = [asyncio.Queue[list | None](self.pages_ahead) for _ in self.sources]
+        fetchers = [
+            asyncio.create_task(self._fetch(source, queue))
+            for source, queue in zip(self.sources, queues)
+        ]
+        try:
+            # (message id, source index, message), one per unfinished source
+            heads = list[tuple[int, int, hikari.Message]]()
+            pages = [iter(())] * len(self.sources)
+
+            async def advance(i: int):
+                while True:
+                    message = next(pages[i], None)
+                    if message is not None:
+                        heapq.heappush(heads, (int(message.id), i, message))
+                        return
+                    page = await queues[i].get()
+                    if page is None:
+                        return
+                    pages[i] = iter(page)
+
+            await asyncio.gather(*(advance(i) for i in range(len(self.sources))))
+            while heads:
+                _, i, message = heapq.heappop(heads)
+                yield self.sources[i], message
+                await advance(i)
+        finally:
+            for fetcher in fetchers:
+                fetcher.cancel()
+            await asyncio.gather(*fetchers, return_exceptions=True)
+
+    async def run(
+        self,
+        ingest: Callable[[BackfillSource, hikari.Message], Awaitable[list]],
+    ) -> BackfillStats:
+        """Passes every message posted by a person to ingest, in posting order."""
+        async for source, message in self.messages():
+            if (
+                message.author.is_bot
+                or message.author.is_system
+                or message.content is None
+            ):
+                continue
+
+            self.stats.messages += 1
+            results = await ingest(source, message)
+            if results:
+                self.stats.matched += 1
+                self.stats.players_added += sum(r.player_added for r in results)
+                self.stats.games_added += sum(r.game_added for r in results)
+                self.stats.results_added += sum(r.result_added for r in results)
+        return self.stats
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import tempfile
+import time
+import zipfile
+from contextlib import closing
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import NamedTuple
+
+from loguru import logger
+
+SNAPSHOT_DATABASE = "gtb.db"
+SNAPSHOT_MANIFEST = "manifest.json"
+
+
+class BackupReport(NamedTuple):
+    path: Path
+    pages: int
+    page_size: int
+    seconds: float
+    # Longest backup step, the most a writer waited on the source lock
+    longest_step: float
+    restarts: int
+    size: int
+
+    @property
+    def throughput(self) -> float:
+        """Copied bytes per second."""
+        return self.pages * self.page_size / self.seconds if self.seconds else 0.0
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def copy_database(
+    source: Path,
+    target: Path,
+    pages: int = 256,
+    pause: float = 0.005,
+    max_restarts: int = 3,
+) -> BackupReport:
+    """Copies a live SQLite database with the online backup API.
+
+    Pages are copied a few at a time and the source is left alone for pause
+    seconds between the steps, so the bot's writes only ever wait for one
+    step. A source in WAL mode is read from one snapshot. Any other source is
+    restarted by each commit made during the copy, after max_restarts it is
+    copied in one step that holds writers back until it is done.
+    """
+    steps = list[float]()
+    restarts = 0
+    remaining_before = None
+    step_start = time.perf_counter()
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal restarts, remaining_before, step_start
+        steps.append(time.perf_counter() - step_start)
+        if remaining_before is not None and remaining > remaining_before:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _TooManyRestarts()
+        remaining_before = remaining
+        time.sleep(pause)
+        step_start = time.perf_counter()
+
+    start = time.perf_counter()
+    with closing(sqlite3.connect(source, timeout=5)) as src, closing(
+        sqlite3.connect(target)
+    ) as dst:
+        page_size = src.execute("PRAGMA page_size").fetchone()[0]
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            # A read transaction in WAL mode does not hold back writers
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        step_start = time.perf_counter()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        except _TooManyRestarts:
+            logger.warning(
+                "Backup of {} restarted {} times, copying it in one step",
+                source,
+                max_restarts,
+            )
+            step_start = time.perf_counter()
+            src.backup(dst)
+            steps.append(time.perf_counter() - step_start)
+        if wal:
+            src.rollback()
+        page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+
+    return BackupReport(
+        path=target,
+        pages=page_count,
+        page_size=page_size,
+        seconds=time.perf_counter() - start,
+        longest_step=max(steps, default=0.0),
+        restarts=restarts,
+        size=target.stat().st_size,
+    )
+
+
+def write_snapshot(
+    source: Path, target: Path, pages: int = 256, pause: float = 0.005
+) -> BackupReport:
+    """Writes a compressed snapshot of a live database.
+
+    The snapshot is a zip with the vacuumed database and a manifest holding
+    its SHA-256, restore_snapshot refuses a snapshot that does not match it.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=target.parent) as tmp:
+        copy = Path(tmp) / SNAPSHOT_DATABASE
+        report = copy_database(source, copy, pages, pause)
+
+        # Compacted on the copy, the live database is not touched
+        with closing(sqlite3.connect(copy, isolation_level=None)) as db:
+            db.execute("PRAGMA journal_mode = DELETE")
+            db.execute("VACUUM")
+
+        manifest = {
+            "source": str(source),
+            "created": datetime.now(timezone.utc).isoformat(),
+            "sha256": file_sha256(copy),
+            "size": copy.stat().st_size,
+            "sqlite_version": sqlite3.sqlite_version,
+        }
+        partial = target.with_name(target.name + ".partial")
+        with zipfile.ZipFile(
+            partial, "w", compression=zipfile.ZIP_LZMA, allowZip64=True
+        ) as snapshot:
+            snapshot.writestr(SNAPSHOT_MANIFEST, json.dumps(manifest, indent=2))
+            snapshot.write(copy, SNAPSHOT_DATABASE)
+        partial.replace(target)
+
+    return report._replace(path=target, size=target.stat().st_size)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest(snapshot: Path) -> dict:
+    with zipfile.ZipFile(snapshot) as z:
+        return json.loads(z.read(SNAPSHOT_MANIFEST))
+
+
+def check_snapshot(snapshot: Path, database: Path) -> dict:
+    """Extracts the database of a snapshot and checks it against its manifest."""
+    with zipfile.ZipFile(snapshot) as z:
+        manifest = json.loads(z.read(SNAPSHOT_MANIFEST))
+        with z.open(SNAPSHOT_DATABASE) as src, open(database, "wb") as dst:
+            while chunk := src.read(1 << 20):
+                dst.write(chunk)
+
+    digest = file_sha256(database)
+    if digest != manifest["sha256"]:
+        raise ValueError(
+            f"Checksum of {snapshot} is {digest}, the manifest says {manifest['sha256']}"
+        )
+    with closing(sqlite3.connect(database)) as db:
+        integrity = db.execute("PRAGMA integrity_check").fetchone()[0]
+    if integrity != "ok":
+        raise ValueError(f"Integrity check of {snapshot} failed: {integrity}")
+    return manifest
+
+
+def restore_snapshot(
+    snapshot: Path, target: Path, pages: int = 256, pause: float = 0.005
+) -> BackupReport:
+    """Replaces the target database with a checked snapshot.
+
+    Written through the backup API, so a bot with the database open sees the
+    restored content on its next transaction instead of a swapped file.
+    """
+    with tempfile.TemporaryDirectory(dir=target.parent) as tmp:
+        copy = Path(tmp) / SNAPSHOT_DATABASE
+        check_snapshot(snapshot, copy)
+        return copy_database(copy, target, pages, pause)._replace(path=target)
+
+
+def prune_snapshots(directory: Path, keep: int) -> list[Path]:
+    snapshots = sorted(directory.glob("gtb-*.zip"))
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        path.unlink()
+    return removed
+
+
+def snapshot_name(now: datetime | None = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    return f"gtb-{now:%Y%m%d-%H%M%S}.zip"
+
+
+async def run_periodic_snapshots(
+    source: Path, directory: Path, interval: float, keep: int
+):
+    """Writes a snapshot every interval seconds, keeping the latest keep."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await asyncio.to_thread(
+                write_snapshot, source, directory / snapshot_name()
+            )
+            await asyncio.to_thread(prune_snapshots, directory, keep)
+        except Exception:
+            logger.exception("Snapshot of {} failed", source)
+            continue
+
+        logger.info(
+            "Snapshot {} of {} pages written in {:.2f}s ({:.1f} MiB/s), "
+            "longest writer stall {:.1f}ms",
+            report.path.name,
+            report.pages,
+            report.seconds,
+            report.throughput / (1 << 20),
+            report.longest_step * 1000,
+        )
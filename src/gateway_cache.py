@@ -0,0 +1,34 @@
+from typing import Literal
+
+from hikari import Intents
+from hikari.impl import CacheComponents, CacheSettings
+
+CacheProfile = Literal["default", "results"]
+
+
+def gateway_intents(cache_members: bool = False) -> Intents:
+    intents = Intents.ALL_MESSAGES | Intents.MESSAGE_CONTENT | Intents.GUILDS
+    if cache_members:
+        # Privileged, lets the member cache hold every member of the guilds
+        intents |= Intents.GUILD_MEMBERS
+    return intents
+
+
+def cache_settings(
+    profile: CacheProfile = "results", cache_members: bool = False
+) -> CacheSettings:
+    """Gateway cache configuration of a profile.
+
+    The default profile is hikari's, caching every object the gateway sends.
+    The results profile keeps only what the bot reads back: its own user and
+    the DM channel ids used to answer players, plus the guild members when
+    they are cached for leaderboard names. Results are parsed from the events
+    themselves, so no messages are cached.
+    """
+    if profile == "default":
+        return CacheSettings()
+
+    components = CacheComponents.ME | CacheComponents.DM_CHANNEL_IDS
+    if cache_members:
+        components |= CacheComponents.MEMBERS
+    return CacheSettings(components=components, max_messages=0)
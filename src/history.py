@@ -0,0 +1,79 @@
+from typing import Iterable
+
+# A round the player has no result for
+MISSING = 0xFF
+
+
+def round_index(identifier: str) -> int:
+    """Position of a round in a history, GuessThe.Game rounds count from 1."""
+    if not is_round_identifier(identifier):
+        raise ValueError(f"{identifier!r} is not a round identifier")
+    return int(identifier) - 1
+
+
+def is_round_identifier(identifier: str) -> bool:
+    """Whether the identifier is a round number as stored, 1 or above without
+    leading zeros, so every round has one identifier and one byte."""
+    return (
+        identifier.isascii() and identifier.isdigit() and not identifier.startswith("0")
+    )
+
+
+def encode(results: Iterable[tuple[int, int]]) -> bytes:
+    """A history from (round index, guesses) pairs, 0 guesses is a lost round.
+
+    Byte i holds the guesses of round i or MISSING, so a player's every round
+    fits in a few KB and is read through a memoryview instead of joining the
+    player's results against every game.
+    """
+    history = bytearray()
+    for index, guesses in results:
+        _set(history, index, guesses)
+    return _trimmed(history)
+
+
+def encode_rounds(results: Iterable[tuple[str, int]]) -> bytes:
+    """A history from (round identifier, guesses) pairs.
+
+    Identifiers that are not a round number, stored before they were checked,
+    have no byte and are left out.
+    """
+    return encode(
+        (round_index(identifier), guesses)
+        for identifier, guesses in results
+        if is_round_identifier(identifier)
+    )
+
+
+def with_round(history: bytes, index: int, guesses: int | None) -> bytes:
+    """The history with the round set, None removes its result."""
+    if index < 0:
+        raise ValueError(f"Round index {index} is before the first round")
+    history = bytearray(history)
+    if guesses is None:
+        if index < len(history):
+            history[index] = MISSING
+    else:
+        _set(history, index, guesses)
+    return _trimmed(history)
+
+
+def guesses_at(history: memoryview, index: int) -> int | None:
+    if index >= len(history) or history[index] == MISSING:
+        return None
+    return history[index]
+
+
+def _set(history: bytearray, index: int, guesses: int):
+    if not 0 <= guesses < MISSING:
+        raise ValueError(f"{guesses} guesses do not fit a history")
+    if index < 0:
+        raise ValueError(f"Round index {index} is before the first round")
+    if index >= len(history):
+        history.extend(bytes([MISSING]) * (index + 1 - len(history)))
+    history[index] = guesses
+
+
+def _trimmed(history: bytearray) -> bytes:
+    # Rounds after the latest result are missing without being stored
+    return bytes(history.rstrip(bytes([MISSING])))
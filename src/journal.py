@@ -0,0 +1,195 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Literal, Optional
+
+from loguru import logger
+from pydantic import BaseModel, Field
+
+
+class JournalEntry(BaseModel):
+    kind: Literal["create", "update", "delete"] = "create"
+    message_id: int
+    channel_id: int
+    guild_id: Optional[int] = None
+    author_id: Optional[int] = None
+    content: Optional[str] = None
+    # When the event was received, the message time is part of its id
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Journal:
+    """Append-only file of incoming messages, one JSON entry per line.
+
+    Appends are written straight away and made durable with one fsync per
+    batch, so a burst of messages costs a single disk flush. The offset of the
+    last entry applied to the database is kept in a separate file.
+    """
+
+    def __init__(self, path: Path, fsync_interval: float = 0.05):
+        self.path = path
+        self.offset_path = path.with_name(path.name + ".offset")
+        # Entries that could not be applied, kept for a manual replay
+        self.failed_path = path.with_name(path.name + ".failed")
+        self.fsync_interval = fsync_interval
+        self._file = open(path, "ab")
+        self._synced: Optional[asyncio.Future] = None
+
+    @property
+    def size(self) -> int:
+        return self._file.tell()
+
+    async def append(self, entry: JournalEntry) -> int:
+        """Writes the entry and returns its end offset once it is on disk."""
+        self._file.write(entry.model_dump_json().encode() + b"\n")
+        end_offset = self._file.tell()
+
+        if self._synced is None:
+            self._synced = asyncio.get_running_loop().create_future()
+            asyncio.create_task(self._sync_batch(self._synced))
+        await asyncio.shield(self._synced)
+
+        return end_offset
+
+    async def _sync_batch(self, synced: asyncio.Future):
+        # Entries appended while waiting join this batch
+        await asyncio.sleep(self.fsync_interval)
+        self._synced = None
+        try:
+            self._file.flush()
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            synced.set_result(None)
+        except Exception as e:
+            synced.set_exception(e)
+
+    def read_from(self, offset: int) -> Iterator[tuple[JournalEntry, int]]:
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                # A torn last line after a crash was never acknowledged
+                if not line.endswith(b"\n"):
+                    break
+                yield JournalEntry.model_validate_json(line), offset
+
+    def applied_offset(self) -> int:
+        try:
+            return int(self.offset_path.read_text())
+        except FileNotFoundError:
+            return 0
+
+    def record_failed(self, entry: JournalEntry):
+        with open(self.failed_path, "ab") as f:
+            f.write(entry.model_dump_json().encode() + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit_offset(self, offset: int):
+        tmp_path = self.offset_path.with_suffix(".tmp")
+        tmp_path.write_text(str(offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def truncate(self):
+        """Empties the journal, only valid when every entry has been applied."""
+        self._file.truncate(0)
+        self._file.seek(0)
+        self.commit_offset(0)
+
+    def close(self):
+        self._file.close()
+
+
+class JournalConsumer:
+    """Applies journal entries to the database in order on a worker thread.
+
+    Entries left unapplied by a crash are replayed on start. A failing entry
+    is retried, so a locked or slow database only delays results. An entry
+    that still fails after max_attempts is moved to the journal's failed file
+    and skipped, so it cannot hold back the entries after it.
+    """
+
+    def __init__(
+        self,
+        journal: Journal,
+        apply: Callable[[JournalEntry], object],
+        truncate_size: int = 1 << 20,
+        retry_delay: float = 1.0,
+        max_attempts: int = 5,
+    ):
+        self.journal = journal
+        self.apply = apply
+        self.truncate_size = truncate_size
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._queue = asyncio.Queue[tuple[JournalEntry, int, asyncio.Future]]()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        offset = self.journal.applied_offset()
+        replayed = 0
+        for entry, end_offset in self.journal.read_from(offset):
+            await self._apply(entry)
+            offset = end_offset
+            replayed += 1
+        self.journal.commit_offset(offset)
+        if replayed:
+            logger.info("Replayed {} journal entries", replayed)
+
+        self._task = asyncio.create_task(self._run(), name="journal-consumer")
+
+    async def stop(self):
+        await self._queue.join()
+        if self._task:
+            self._task.cancel()
+        self._executor.shutdown()
+        self.journal.close()
+
+    async def submit(self, entry: JournalEntry):
+        """Journals the entry and waits for the result of applying it."""
+        end_offset = await self.journal.append(entry)
+        applied = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((entry, end_offset, applied))
+        return await applied
+
+    async def _apply(self, entry: JournalEntry):
+        loop = asyncio.get_running_loop()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await loop.run_in_executor(self._executor, self.apply, entry)
+            except Exception:
+                logger.exception(
+                    "Applying journal entry for message {} failed, attempt {} of {}",
+                    entry.message_id,
+                    attempt,
+                    self.max_attempts,
+                )
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self.retry_delay)
+
+        logger.error(
+            "Skipping journal entry for message {}, written to {}",
+            entry.message_id,
+            self.journal.failed_path,
+        )
+        await asyncio.to_thread(self.journal.record_failed, entry)
+        return None
+
+    async def _run(self):
+        while True:
+            entry, end_offset, applied = await self._queue.get()
+            result = await self._apply(entry)
+            applied.set_result(result)
+            self._queue.task_done()
+
+            if not self._queue.empty():
+                continue
+
+            # Caught up, persist how far the database is
+            if end_offset >= self.truncate_size and end_offset == self.journal.size:
+                self.journal.truncate()
+            else:
+                self.journal.commit_offset(end_offset)
@@ -0,0 +1,100 @@
+import atexit
+import itertools
+import queue
+import sys
+import threading
+from typing import TextIO
+
+from loguru import logger
+
+
+class BackgroundSink:
+    """Writes formatted log lines to a stream from a thread of its own.
+
+    The logging thread only formats the line and puts it on a queue. loguru's
+    own enqueue pickles every record through a pipe, which costs the caller
+    more than a buffered write does.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._write, name="log-sink", daemon=True
+        )
+        self._thread.start()
+
+    def __call__(self, message: str):
+        self._queue.put(message)
+
+    def _write(self):
+        while (message := self._queue.get()) is not None:
+            self.stream.write(message)
+            if self._queue.empty():
+                self.stream.flush()
+        self.stream.flush()
+
+    def close(self):
+        """Writes what is queued and stops the thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+_sink: BackgroundSink | None = None
+
+
+def configure_logging(
+    level: str = "INFO", stream: TextIO = sys.stderr, enqueue: bool = True
+) -> int:
+    """Replaces loguru's default handler, writing from a background thread.
+
+    Returns the handler id. The queued lines are written before exit.
+    """
+    global _sink
+
+    close_logging()
+    if not enqueue:
+        return logger.add(stream, level=level)
+
+    _sink = BackgroundSink(stream)
+    atexit.register(_sink.close)
+    return logger.add(_sink, level=level, colorize=stream.isatty())
+
+
+def close_logging():
+    """Removes the handlers and writes the lines still queued."""
+    global _sink
+
+    logger.remove()
+    if _sink is not None:
+        _sink.close()
+        _sink = None
+
+
+class _Muted:
+    """Drops every call, stands in for the logger on skipped samples."""
+
+    def __getattr__(self, name):
+        return self._drop
+
+    def _drop(self, *args, **kwargs):
+        return None
+
+
+_muted = _Muted()
+_call_counts = dict[tuple, itertools.count]()
+
+
+def sampled(every: int):
+    """The logger on every n:th call from the calling line, else a muted one.
+
+    Decided before the message is built, so skipped samples cost no formatting:
+        sampled(100).debug("Pattern found with {} guesses", guesses)
+    """
+    frame = sys._getframe(1)
+    site = (frame.f_code, frame.f_lineno)
+    counter = _call_counts.get(site)
+    if counter is None:
+        counter = _call_counts.setdefault(site, itertools.count())
+    return logger if next(counter) % every == 0 else _muted
@@ -6,7 +6,10 @@ from typing import NamedTuple
 
 from loguru import logger
 
-from src import repository
+from src import repository, service
+from src.journal import JournalEntry
+from src.logging_setup import sampled
+from src.ranking import streak_index
 from src.repository import game_exists
 
 gtg_pattern = re.compile(
@@ -42,16 +45,24 @@ def get_gtg_result(msg_content: str, submit_date: date) -> list[PatternResult] |
         # if no id compute id from submit date
         if r.group("id") is None:
             td = submit_date - gtg_first_date
-            id_string = str(td.days + 1)
+            round_number = td.days + 1
         else:
-            id_string = r.group("id")
+            round_number = int(r.group("id"))
+
+        if round_number < 1:
+            logger.debug("Result for round {} before the first round", round_number)
+            continue
+        # Stored without leading zeros, #05 and #5 are the same round
+        id_string = str(round_number)
 
         score_str = re.sub(r"\s", "", r.group("score"))
         err_val = score_str.find("🟩")
         guesses = err_val + 1
 
-        logger.debug(
-            f"Pattern for GuessThe.Game found with identifier {id_string} with {guesses} guesses"
+        sampled(100).debug(
+            "Pattern for GuessThe.Game found with identifier {} with {} guesses",
+            id_string,
+            guesses,
         )
         pattern_results.append(
             PatternResult(game_identifier=id_string, guesses=guesses)
@@ -64,6 +75,7 @@ def process_message(
     message_content: str,
     message_id: int,
     author_id: int,
+    guild_id: int,
 ) -> list[ProcessResult] | None:
     pattern_res = get_gtg_result(
         message_content, repository.snowflake_to_datetime(message_id).date()
@@ -71,13 +83,33 @@ def process_message(
     if not pattern_res:
         return
 
+    return register_pattern_results(pattern_res, message_id, author_id, guild_id)
+
+
+def register_pattern_results(
+    pattern_res: list[PatternResult],
+    message_id: int,
+    author_id: int,
+    guild_id: int,
+) -> list[ProcessResult]:
     result_list = list[ProcessResult]()
 
     for pr in pattern_res:
         process_result = ProcessResult()
 
-        if not repository.player_exists(author_id):
-            repository.add_player(user_id=author_id, message_id=message_id)
+        # Reposts of a recent round are answered from memory
+        known = repository.recent_results.contains(
+            guild_id, author_id, pr.game_identifier
+        )
+        if known:
+            process_result.message += already_registered(pr.game_identifier)
+            result_list.append(process_result)
+            continue
+
+        if not repository.player_exists(guild_id, author_id):
+            repository.add_player(
+                guild_id=guild_id, user_id=author_id, message_id=message_id
+            )
             process_result.player_added = True
             process_result.message += (
                 "Tack för din första guess the X postning! Du är nu registrerad som spelare!⚔️"
@@ -98,22 +130,24 @@ def process_message(
                 + os.linesep
             )
 
-        if repository.result_exists(
-            user_id=author_id, game_identifier=pr.game_identifier
+        # A round not known in memory is older than the latest few
+        if known is None and repository.result_exists(
+            guild_id=guild_id, user_id=author_id, game_identifier=pr.game_identifier
         ):
-            process_result.message += (
-                f"Du har redan sparat ett resultat för omgång #{pr.game_identifier}.✋"
-                + os.linesep
-            )
+            process_result.message += already_registered(pr.game_identifier)
             result_list.append(process_result)
             continue
 
-        repository.add_result(
+        if not repository.add_result(
+            guild_id=guild_id,
             user_id=author_id,
             message_id=message_id,
             game_identifier=pr.game_identifier,
             guesses=pr.guesses,
-        )
+        ):
+            process_result.message += already_registered(pr.game_identifier)
+            result_list.append(process_result)
+            continue
 
         process_result.message += f"Du har registrerat ett resultat på {pr.guesses} gissning(ar) för omgång {pr.game_identifier}!👍"
 
@@ -121,4 +155,107 @@ def process_message(
 
         result_list.append(process_result)
 
+    if any(r.game_added for r in result_list):
+        streak_index.invalidate()
+    elif any(r.result_added for r in result_list):
+        streak_index.refresh(guild_id, author_id)
+
+    return result_list
+
+
+def already_registered(game_identifier: str) -> str:
+    return (
+        f"Du har redan sparat ett resultat för omgång #{game_identifier}.✋" + os.linesep
+    )
+
+
+def process_message_edit(
+    message_content: str,
+    message_id: int,
+    author_id: int,
+    guild_id: int,
+) -> list[ProcessResult] | None:
+    """Brings the results stored for an edited message in line with its new content.
+
+    Each changed result is updated or deleted in place and results for rounds
+    that were added in the edit are registered as for a new message.
+    """
+    pattern_res = (
+        get_gtg_result(
+            message_content, repository.snowflake_to_datetime(message_id).date()
+        )
+        or []
+    )
+    edited = {pr.game_identifier: pr.guesses for pr in pattern_res}
+    stored = {
+        r.game_identifier: r.guesses or 0
+        for r in repository.get_message_results(message_id)
+        if r.guild_id == guild_id
+    }
+
+    for game_identifier, guesses in stored.items():
+        if game_identifier not in edited:
+            repository.delete_result(guild_id, message_id, game_identifier)
+        elif edited[game_identifier] != guesses:
+            repository.update_result(
+                guild_id, message_id, game_identifier, edited[game_identifier]
+            )
+
+    if stored:
+        streak_index.refresh(guild_id, author_id)
+
+    added = [pr for pr in pattern_res if pr.game_identifier not in stored]
+    if not added:
+        return
+
+    return register_pattern_results(added, message_id, author_id, guild_id)
+
+
+def process_message_delete(message_id: int) -> int:
+    results = repository.get_message_results(message_id)
+    for r in results:
+        repository.delete_result(r.guild_id, message_id, r.game_identifier)
+        streak_index.refresh(r.guild_id, r.user_id)
+
+    return len(results)
+
+
+def process_journal_entry(entry: JournalEntry) -> list[ProcessResult]:
+    """Applies a journaled message event to every guild the result belongs to.
+
+    Results posted in a guild channel go to that guild, DMs to each guild the
+    author plays in. Applying an entry twice leaves the same results stored, so
+    entries can be replayed after a crash.
+    """
+    if entry.kind == "delete":
+        process_message_delete(entry.message_id)
+        return []
+
+    guild_ids = (
+        [entry.guild_id]
+        if entry.guild_id is not None
+        else service.get_result_guilds(entry.author_id)
+    )
+
+    result_list = list[ProcessResult]()
+    for guild_id in guild_ids:
+        if repository.player_exists(
+            guild_id, entry.author_id
+        ) and not service.is_player_active(guild_id, entry.author_id):
+            logger.debug(
+                "Player with user id {} has opted out of result saving in guild {}.",
+                entry.author_id,
+                guild_id,
+            )
+            continue
+
+        process = process_message if entry.kind == "create" else process_message_edit
+        res = process(
+            message_content=entry.content or "",
+            message_id=entry.message_id,
+            author_id=entry.author_id,
+            guild_id=guild_id,
+        )
+        result_list.extend(res or [])
+
     return result_list
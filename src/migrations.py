@@ -0,0 +1,144 @@
+import sqlite3
+from pathlib import Path
+
+from loguru import logger
+
+from src.settings import settings
+
+
+def table_columns(con: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{table}")')]
+
+
+def has_unique_key(
+    con: sqlite3.Connection, table: str, columns: tuple[str, ...]
+) -> bool:
+    for _, name, unique, *_ in con.execute(f'PRAGMA index_list("{table}")'):
+        indexed = con.execute(f'PRAGMA index_info("{name}")').fetchall()
+        if unique and tuple(row[2] for row in indexed) == columns:
+            return True
+    return False
+
+
+def add_guild_partitioning(con: sqlite3.Connection):
+    """Moves players of a single guild database into a guild partition.
+
+    The guild and its channel are taken from SERVER_ID and GTG_CHANNEL_ID.
+    """
+    server_id, channel_id = settings.server_id, settings.gtg_channel_id
+    if server_id is None:
+        raise RuntimeError("SERVER_ID must be set to migrate existing players")
+
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS "Guild" (
+          "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+          "guild_snowflake" BIGINT UNIQUE NOT NULL,
+          "channel_snowflake" BIGINT
+        )
+        """
+    )
+    con.execute(
+        """
+        CREATE TABLE "Player_new" (
+          "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+          "guild" INTEGER NOT NULL REFERENCES "Guild" ("id") ON DELETE CASCADE,
+          "user_snowflake" BIGINT NOT NULL,
+          "join_datetime" DATETIME NOT NULL,
+          "active" BOOLEAN NOT NULL,
+          "visible" BOOLEAN NOT NULL,
+          CONSTRAINT "unq_player__guild_user_snowflake" UNIQUE ("guild", "user_snowflake")
+        )
+        """
+    )
+    con.execute(
+        'INSERT OR IGNORE INTO "Guild" ("guild_snowflake", "channel_snowflake") VALUES (?, ?)',
+        (server_id, channel_id),
+    )
+    con.execute(
+        """
+        INSERT INTO "Player_new"
+        SELECT p."id", g."id", p."user_snowflake", p."join_datetime", p."active", p."visible"
+        FROM "Player" p, "Guild" g WHERE g."guild_snowflake" = ?
+        """,
+        (server_id,),
+    )
+    con.execute('DROP TABLE "Player"')
+    con.execute('ALTER TABLE "Player_new" RENAME TO "Player"')
+    con.execute(
+        'CREATE INDEX "idx_player__user_snowflake" ON "Player" ("user_snowflake")'
+    )
+
+
+def add_result_unique_key(con: sqlite3.Connection):
+    """Keeps the first submitted result of each player and round and makes the
+    pair unique.
+
+    The period totals and guess counts of players with removed results are
+    recounted with the rebuild commands of admin.py.
+    """
+    removed = con.execute(
+        """
+        DELETE FROM "Result" WHERE "id" IN (
+          SELECT "id" FROM (
+            SELECT "id", ROW_NUMBER() OVER (
+              PARTITION BY "player", "game" ORDER BY "submit_time", "id"
+            ) AS "n"
+            FROM "Result"
+          ) WHERE "n" > 1
+        )
+        """
+    ).rowcount
+    if removed:
+        logger.warning(
+            "Removed {} duplicate results, run rebuild-periods and "
+            "rebuild-histograms of admin.py to recount their statistics",
+            removed,
+        )
+    con.execute(
+        'CREATE UNIQUE INDEX "unq_result__player_game" ON "Result" ("player", "game")'
+    )
+
+
+# (table, column, migration) applied in order when the column is missing
+migrations = [
+    ("Player", "guild", add_guild_partitioning),
+]
+
+# (table, columns, migration) applied in order when the columns are not unique
+unique_key_migrations = [
+    ("Result", ("player", "game"), add_result_unique_key),
+]
+
+
+def migrate_sqlite(filename: str):
+    """Brings an existing SQLite database up to date with the entity definitions."""
+    if not Path(filename).exists():
+        return
+
+    con = sqlite3.connect(filename, isolation_level=None)
+    try:
+        con.execute("PRAGMA foreign_keys = OFF")
+        for table, column, migration in migrations:
+            columns = table_columns(con, table)
+            if not columns or column in columns:
+                continue
+            apply_migration(con, migration)
+
+        for table, key, migration in unique_key_migrations:
+            if not table_columns(con, table) or has_unique_key(con, table, key):
+                continue
+            apply_migration(con, migration)
+    finally:
+        con.close()
+
+
+def apply_migration(con: sqlite3.Connection, migration):
+    logger.info("Migrating database with {}", migration.__name__)
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        migration(con)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
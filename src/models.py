@@ -1,4 +1,3 @@
-import os
 from datetime import date, datetime
 from functools import total_ordering
 from pathlib import Path
@@ -6,66 +5,181 @@ from typing import Optional
 
 import pony.orm
 import rootpath
-from dotenv import load_dotenv
-from pony.orm import Database, PrimaryKey, Required, Set, set_sql_debug, db_session
+from pony.orm import (
+    Database,
+    PrimaryKey,
+    Required,
+    Set,
+    composite_key,
+    set_sql_debug,
+    db_session,
+)
 from pydantic import BaseModel
 
-load_dotenv()
+from src.migrations import migrate_sqlite
+from src.settings import settings
 
 path = rootpath.detect()
 
-db = Database(
-    provider="sqlite",
-    filename=str(Path(path) / "data" / os.getenv("DB_FILE")),
-    create_db=True,
-)
+if settings.db_provider == "postgres":
+    db_params = dict(
+        provider="postgres",
+        host=settings.db_host,
+        port=settings.db_port,
+        user=settings.db_user,
+        password=settings.db_password,
+        database=settings.db_name,
+    )
+    # Every transaction on the reporting connection is read-only, this survives
+    # the DISCARD ALL Pony issues when a connection goes back to its pool
+    read_db_params = dict(db_params, options="-c default_transaction_read_only=on")
+else:
+    db_params = dict(
+        provider="sqlite",
+        filename=str(Path(path) / "data" / settings.db_file),
+    )
+    read_db_params = db_params
 
+# Live ingestion writes go through db, reporting reads go through read_db which
+# has its own read-only connection so heavy reads never contend with commits.
+db = Database()
+read_db = Database()
 
-class PlayerDto(BaseModel):
-    user_id: int
-    join_date: date
-    active: bool
-    visible: bool
 
+def define_entities(database: Database):
+    class Guild(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        guild_snowflake = Required(int, unique=True, size=64)
+        channel_snowflake = pony.orm.Optional(int, size=64)
+        players = Set("Player")
+        guess_counts = Set("GuildGuessCount")
+
+    class Player(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        guild = Required(Guild)
+        user_snowflake = Required(int, size=64, index=True)
+        join_datetime = Required(datetime)
+        active = Required(bool, default=True)
+        visible = Required(bool, default=True)
+        results = Set("Result")
+        period_totals = Set("PeriodTotal")
+        guess_counts = Set("GuessCount")
+        histories = Set("ResultHistory")
+        composite_key(guild, user_snowflake)
+
+    class GameType(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        identifier = Required(str, unique=True)
+        name = Required(str, unique=True)
+        publish_date = Required(date)
+        games = Set("Game")
+        period_totals = Set("PeriodTotal")
+        guess_counts = Set("GuessCount")
+        guild_guess_counts = Set("GuildGuessCount")
+        histories = Set("ResultHistory")
+
+    class Game(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        game_type = Required(GameType)
+        identifier = Required(str, unique=True)
+        title = pony.orm.Optional(str)
+        publish_date = Required(date)
+        results = Set("Result")
+
+    class Result(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        message_snowflake = Required(int, size=64, index=True)
+        player = Required(Player)
+        game = Required(Game)
+        submit_time = Required(datetime)
+        guesses = Required(int)
+        composite_key(player, game)
+
+    # Results of a player in the rounds of one ISO week or month
+    class PeriodTotal(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        player = Required(Player)
+        game_type = Required(GameType)
+        period = Required(str, index=True)
+        played = Required(int)
+        won = Required(int)
+        total_guesses = Required(int)
+        max_streak = Required(int)
+        composite_key(player, game_type, period)
+
+    # Results of a player by number of guesses, 0 is a lost round
+    class GuessCount(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        player = Required(Player)
+        game_type = Required(GameType)
+        guesses = Required(int)
+        count = Required(int)
+        composite_key(player, game_type, guesses)
 
-class Player(db.Entity):
-    id = PrimaryKey(int, auto=True)
-    user_snowflake = Required(int, unique=True, size=64)
-    join_datetime = Required(datetime)
-    active = Required(bool, default=True)
-    visible = Required(bool, default=True)
-    results = Set("Result")
+    # The same counts over every player of a guild
+    class GuildGuessCount(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        guild = Required(Guild)
+        game_type = Required(GameType)
+        guesses = Required(int)
+        count = Required(int)
+        composite_key(guild, game_type, guesses)
 
+    # Results of a player as one byte per round, see src/history.py
+    class ResultHistory(database.Entity):
+        id = PrimaryKey(int, auto=True)
+        player = Required(Player)
+        game_type = Required(GameType)
+        rounds = Required(bytes)
+        composite_key(player, game_type)
 
-class GameType(db.Entity):
-    id = PrimaryKey(int, auto=True)
-    identifier = Required(str, unique=True)
-    name = Required(str, unique=True)
-    publish_date = Required(date)
-    games = Set("Game")
 
+define_entities(db)
+define_entities(read_db)
 
-class Game(db.Entity):
-    id = PrimaryKey(int, auto=True)
-    game_type = Required(GameType)
-    identifier = Required(str, unique=True)
-    title = pony.orm.Optional(str)
-    publish_date = Required(date)
-    results = Set("Result")
+Guild = db.Guild
+Player = db.Player
+GameType = db.GameType
+Game = db.Game
+Result = db.Result
+PeriodTotal = db.PeriodTotal
+GuessCount = db.GuessCount
+GuildGuessCount = db.GuildGuessCount
+ResultHistory = db.ResultHistory
 
 
-class Result(db.Entity):
-    id = PrimaryKey(int, auto=True)
-    message_snowflake = Required(int, size=64)
-    player = Required(Player)
-    game = Required(Game)
-    submit_time = Required(datetime)
-    guesses = Required(int)
+@db.on_connect(provider="sqlite")
+def sqlite_write_ahead_log(database, connection):
+    # WAL lets readers keep a snapshot while the writer commits
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute("PRAGMA busy_timeout = 5000")
+
+
+@read_db.on_connect(provider="sqlite")
+def sqlite_read_only(database, connection):
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA busy_timeout = 5000")
+    cursor.execute("PRAGMA query_only = ON")
+
+
+class GuildDto(BaseModel):
+    guild_id: int
+    channel_id: Optional[int] = None
+
+
+class PlayerDto(BaseModel):
+    guild_id: int
+    user_id: int
+    join_date: date
+    active: bool
+    visible: bool
 
 
 class ResultDto(BaseModel):
     submit_time: datetime
     message_id: int
+    guild_id: int
     user_id: int
     game_type_name: str
     game_identifier: str
@@ -75,6 +189,7 @@ class ResultDto(BaseModel):
 
 
 class PlayerTotal(BaseModel):
+    guild_id: int
     user_id: int
     played_games: int
     won: int
@@ -85,25 +200,119 @@ class PlayerTotal(BaseModel):
     join_date: datetime
 
 
+class PlayerProfile(BaseModel):
+    """Everything reported about a player's results, computed in one pass."""
+
+    guild_id: int
+    user_id: int
+    join_date: datetime
+    played_games: int
+    won: int
+    current_streak: int
+    current_streak_guesses: int
+    max_streak: int
+    max_loosing_streak: int
+    last_submit_time: Optional[datetime] = None
+    # Results by number of guesses, 0 is a lost round
+    guess_distribution: dict[int, int]
+    # Missed rounds, oldest first, as an identifier or a (first, last) range
+    gaps: list[str | tuple[str, str]]
+
+    @property
+    def win_rate(self) -> str:
+        return f"{self.won / self.played_games:.2%}" if self.played_games else "-"
+
+    def total(self) -> "PlayerTotal":
+        return PlayerTotal(
+            guild_id=self.guild_id,
+            user_id=self.user_id,
+            played_games=self.played_games,
+            won=self.won,
+            win_rate=self.win_rate,
+            current_streak=self.current_streak,
+            max_streak=self.max_streak,
+            max_loosing_streak=self.max_loosing_streak,
+            join_date=self.join_date,
+        )
+
+    def streak(self) -> "PlayerStreak":
+        return PlayerStreak(
+            guild_id=self.guild_id,
+            user_id=self.user_id,
+            current_streak=self.current_streak,
+            total_guesses=self.current_streak_guesses,
+            last_submit_time=self.last_submit_time,
+        )
+
+
+class PeriodTotalDto(BaseModel):
+    guild_id: int
+    user_id: int
+    period: str
+    played: int
+    won: int
+    total_guesses: int
+    max_streak: int
+
+
+class GuessDistribution(BaseModel):
+    guild_id: int
+    # None for the distribution of the whole guild
+    user_id: Optional[int] = None
+    # Results by number of guesses, 0 is a lost round
+    counts: dict[int, int]
+
+    @property
+    def played(self) -> int:
+        return sum(self.counts.values())
+
+
+class LeaderboardEntry(BaseModel):
+    guild_id: int
+    user_id: int
+    value: float
+    played_games: Optional[int] = None
+
+
 @total_ordering
 class PlayerStreak(BaseModel):
+    guild_id: int
     user_id: int
     current_streak: int
     total_guesses: int
-    last_submit_time: datetime
+    last_submit_time: Optional[datetime] = None
 
-    def __lt__(self, other):
-        return (self.current_streak, -self.total_guesses, self.last_submit_time) > (
-            other.current_streak,
-            -other.total_guesses,
-            other.last_submit_time,
+    def sort_key(self) -> tuple:
+        """Longest streak first, then fewest guesses, then most recent result."""
+        return (
+            -self.current_streak,
+            self.total_guesses,
+            -self.last_submit_time.timestamp() if self.last_submit_time else 0,
         )
 
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
 
-if os.getenv("ENVIRONMENT") == "dev":
+if settings.environment == "dev":
     set_sql_debug(debug=True)
 
-db.generate_mapping(check_tables=True, create_tables=True)
+
+def bind_read_db():
+    """Binds the read-only connection, without migrating or creating tables."""
+    read_db.bind(**read_db_params)
+    read_db.generate_mapping(check_tables=True)
+
+
+if not settings.read_only:
+    if settings.db_provider == "sqlite":
+        migrate_sqlite(db_params["filename"])
+        db.bind(**db_params, create_db=True)
+    else:
+        db.bind(**db_params)
+    db.generate_mapping(check_tables=True, create_tables=True)
+
+    bind_read_db()
 
 
 @db_session
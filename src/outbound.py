@@ -0,0 +1,206 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum
+
+from loguru import logger
+
+MESSAGE_LIMIT = 2000
+
+
+class Priority(IntEnum):
+    """Lower goes first, part of answering a command comes before bulk sends."""
+
+    INTERACTION = 0
+    REPLY = 1
+    BULK = 2
+
+
+def split_message(content: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Splits content into messages of at most limit characters.
+
+    Splits at the last line break of each message, lines longer than the
+    limit are cut.
+    """
+    parts = list[str]()
+    while len(content) > limit:
+        cut = content.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            parts.append(content[:limit])
+            content = content[limit:]
+        else:
+            parts.append(content[:cut])
+            content = content[cut + 1 :]
+    if content.strip():
+        parts.append(content)
+    return parts
+
+
+class RouteBucket:
+    """Sliding window of the requests sent on one route, mirroring Discord's
+    limit of messages per channel so a throttled channel waits in the queue
+    instead of holding up the sends to others."""
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.sent = deque[float]()
+        # Keeps the messages of a channel in order
+        self.lock = asyncio.Lock()
+
+    def delay(self) -> float:
+        now = time.monotonic()
+        while self.sent and self.sent[0] <= now - self.period:
+            self.sent.popleft()
+        if len(self.sent) < self.limit:
+            return 0.0
+        return self.sent[0] + self.period - now
+
+    async def acquire(self):
+        while (wait := self.delay()) > 0:
+            await asyncio.sleep(wait)
+        self.sent.append(time.monotonic())
+
+
+@dataclass
+class Outbound:
+    channel_id: int
+    priority: Priority
+    parts: list[str]
+    future: asyncio.Future
+    queued: bool = False
+    taken: bool = False
+
+
+class OutboundSender:
+    """Sends bot messages to channels through one prioritized queue.
+
+    Messages to a channel within window seconds of each other are merged into
+    one and split again at Discord's length limit. Interaction responses are
+    answered through the interaction itself and never wait in this queue.
+    """
+
+    def __init__(
+        self,
+        rest,
+        window: float = 0.25,
+        route_limit: int = 5,
+        route_period: float = 5.0,
+        limit: int = MESSAGE_LIMIT,
+    ):
+        self.rest = rest
+        self.window = window
+        self.route_limit = route_limit
+        self.route_period = route_period
+        self.limit = limit
+        self.sent = 0
+        self._queue = asyncio.PriorityQueue()
+        self._pending = dict[int, Outbound]()
+        self._buckets = dict[int, RouteBucket]()
+        self._sequence = itertools.count()
+        self._tasks = set[asyncio.Task]()
+        self._outstanding = set[asyncio.Future]()
+        self._worker: asyncio.Task | None = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def flush(self):
+        """Sends what is pending without waiting for the window to pass."""
+        for outbound in list(self._pending.values()):
+            self._enqueue(outbound)
+        if self._outstanding:
+            await asyncio.gather(*self._outstanding, return_exceptions=True)
+
+    async def stop(self):
+        """Sends what is pending and stops the worker."""
+        await self.flush()
+        if self._worker:
+            self._worker.cancel()
+
+    def send(
+        self, channel_id: int, content: str, priority: Priority = Priority.REPLY
+    ) -> asyncio.Future:
+        """Queues content for the channel, resolved with the messages sent."""
+        channel_id = int(channel_id)
+        outbound = self._pending.get(channel_id)
+        if outbound is None:
+            future = asyncio.get_running_loop().create_future()
+            # Failures are logged, callers need not wait for the delivery
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            future.add_done_callback(self._outstanding.discard)
+            self._outstanding.add(future)
+            outbound = Outbound(channel_id, priority, [content], future)
+            self._pending[channel_id] = outbound
+            if priority == Priority.INTERACTION:
+                self._enqueue(outbound)
+            else:
+                asyncio.get_running_loop().call_later(
+                    self.window, self._enqueue, outbound
+                )
+        else:
+            # Merged until it is taken for delivery, also while queued
+            outbound.parts.append(content)
+            if priority < outbound.priority:
+                outbound.priority = priority
+                if priority == Priority.INTERACTION:
+                    # The earlier queue entry is skipped once this one is taken
+                    outbound.queued = True
+                    self._put(outbound)
+        return outbound.future
+
+    def _enqueue(self, outbound: Outbound):
+        if not outbound.queued:
+            outbound.queued = True
+            self._put(outbound)
+
+    def _put(self, outbound: Outbound):
+        self._queue.put_nowait((outbound.priority, next(self._sequence), outbound))
+
+    def _bucket(self, channel_id: int) -> RouteBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = RouteBucket(self.route_limit, self.route_period)
+            self._buckets[channel_id] = bucket
+        return bucket
+
+    async def _run(self):
+        while True:
+            _, _, outbound = await self._queue.get()
+            if outbound.taken:
+                continue
+            wait = self._bucket(outbound.channel_id).delay()
+            if wait > 0:
+                # Requeued once the route has room, other routes go first
+                asyncio.get_running_loop().call_later(wait, self._put, outbound)
+                continue
+
+            outbound.taken = True
+            if self._pending.get(outbound.channel_id) is outbound:
+                del self._pending[outbound.channel_id]
+            task = asyncio.create_task(self._deliver(outbound))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, outbound: Outbound):
+        bucket = self._bucket(outbound.channel_id)
+        messages = []
+        try:
+            async with bucket.lock:
+                for part in split_message("\n".join(outbound.parts), self.limit):
+                    await bucket.acquire()
+                    messages.append(
+                        await self.rest.create_message(outbound.channel_id, part)
+                    )
+                    self.sent += 1
+        except Exception as e:
+            logger.opt(exception=e).warning(
+                "Sending to channel {} failed after {} message(s)",
+                outbound.channel_id,
+                len(messages),
+            )
+            outbound.future.set_exception(e)
+        else:
+            outbound.future.set_result(messages)
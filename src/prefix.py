@@ -0,0 +1,131 @@
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime
+
+from src.models import PlayerProfile
+
+
+class ResultPrefix:
+    """Running totals of a player's results after each round, oldest first.
+
+    Entry i holds the statistics as they were once round i was published, so a
+    profile as of a day is a binary search over the publish dates instead of a
+    pass over every round. Built from the rows of all rounds with the player's
+    result, None where the round was not played.
+    """
+
+    def __init__(
+        self,
+        join_datetime: datetime,
+        rows: list[tuple[str, date, datetime | None, int | None]],
+    ):
+        self.join_datetime = join_datetime
+        self.identifiers = list[str]()
+        self.dates = list[date]()
+        self.submit_times = list[datetime | None]()
+        self.played = array("l")
+        self.won = array("l")
+        self.current_streak = array("l")
+        self.current_streak_guesses = array("l")
+        self.max_streak = array("l")
+        self.max_loosing_streak = array("l")
+        # Round of the latest result so far, -1 before the first
+        self.last_played = array("l")
+        # Results by number of guesses so far, 0 is a lost round
+        self.distribution = dict[int, array]()
+        # Missed rounds as (first, last) round, ordered by last
+        self.gaps = list[tuple[int, int]]()
+
+        played = won = 0
+        streak = streak_guesses = current = current_guesses = 0
+        max_streak = loosing_streak = max_loosing_streak = 0
+        last_played = gap_start = -1
+        counts = dict[int, int]()
+        for i, (identifier, publish_date, submit_time, guesses) in enumerate(rows):
+            self.identifiers.append(identifier)
+            self.dates.append(publish_date)
+            self.submit_times.append(submit_time)
+
+            if submit_time is None:
+                # Breaks the streak only once a later round is played
+                streak = streak_guesses = 0
+                if gap_start < 0:
+                    gap_start = i
+            else:
+                if gap_start >= 0:
+                    self.gaps.append((gap_start, i - 1))
+                    gap_start = -1
+                played += 1
+                counts[guesses] = counts.get(guesses, 0) + 1
+                if guesses not in self.distribution:
+                    self.distribution[guesses] = array("l", [0] * i)
+                last_played = i
+                if guesses:
+                    won += 1
+                    streak += 1
+                    streak_guesses += guesses
+                    max_streak = max(max_streak, streak)
+                    loosing_streak = 0
+                else:
+                    streak = streak_guesses = 0
+                    loosing_streak += 1
+                    max_loosing_streak = max(max_loosing_streak, loosing_streak)
+                current, current_guesses = streak, streak_guesses
+
+            self.played.append(played)
+            self.won.append(won)
+            self.current_streak.append(current)
+            self.current_streak_guesses.append(current_guesses)
+            self.max_streak.append(max_streak)
+            self.max_loosing_streak.append(max_loosing_streak)
+            self.last_played.append(last_played)
+            for guesses, column in self.distribution.items():
+                column.append(counts[guesses])
+
+        self._gap_ends = [end for _, end in self.gaps]
+
+    def index(self, as_of: date) -> int:
+        """The latest round published on or before the day, -1 if none."""
+        return bisect_right(self.dates, as_of) - 1
+
+    def profile(self, guild_id: int, user_id: int, as_of: date) -> PlayerProfile:
+        i = self.index(as_of)
+        last = self.last_played[i] if i >= 0 else -1
+        if last < 0:
+            return PlayerProfile(
+                guild_id=guild_id,
+                user_id=user_id,
+                join_date=self.join_datetime,
+                played_games=0,
+                won=0,
+                current_streak=0,
+                current_streak_guesses=0,
+                max_streak=0,
+                max_loosing_streak=0,
+                guess_distribution={},
+                gaps=[],
+            )
+
+        gaps = list[str | tuple[str, str]]()
+        for first, end in self.gaps[: bisect_right(self._gap_ends, last)]:
+            first, end = self.identifiers[first], self.identifiers[end]
+            gaps.append(first if first == end else (first, end))
+
+        return PlayerProfile(
+            guild_id=guild_id,
+            user_id=user_id,
+            join_date=self.join_datetime,
+            played_games=self.played[i],
+            won=self.won[i],
+            current_streak=self.current_streak[i],
+            current_streak_guesses=self.current_streak_guesses[i],
+            max_streak=self.max_streak[i],
+            max_loosing_streak=self.max_loosing_streak[i],
+            last_submit_time=self.submit_times[last],
+            guess_distribution={
+                guesses: column[i]
+                for guesses, column in self.distribution.items()
+                if column[i]
+            },
+            gaps=gaps,
+        )
@@ -0,0 +1,166 @@
+import threading
+from bisect import bisect_left, insort
+from typing import NamedTuple
+
+from loguru import logger
+
+from src import repository
+from src.models import PlayerStreak
+
+
+class StreakRank(NamedTuple):
+    position: int
+    total: int
+    streak: PlayerStreak
+
+
+class GuildStreaks:
+    def __init__(self):
+        # Sorted (sort key, user id) of every ranked player
+        self.keys = list[tuple]()
+        self.streaks = dict[int, PlayerStreak]()
+
+    def put(self, streak: PlayerStreak):
+        self.remove(streak.user_id)
+        self.streaks[streak.user_id] = streak
+        insort(self.keys, (streak.sort_key(), streak.user_id))
+
+    def remove(self, user_id: int):
+        streak = self.streaks.pop(user_id, None)
+        if streak is not None:
+            del self.keys[bisect_left(self.keys, (streak.sort_key(), user_id))]
+
+    def position(self, user_id: int) -> int | None:
+        streak = self.streaks.get(user_id)
+        if streak is None:
+            return None
+        return bisect_left(self.keys, (streak.sort_key(), user_id))
+
+    def rank(self, index: int) -> StreakRank:
+        _, user_id = self.keys[index]
+        return StreakRank(index + 1, len(self.keys), self.streaks[user_id])
+
+
+class StreakIndex:
+    """Current streak chart of each guild kept in order for rank lookups.
+
+    Holds the same players and ordering as generate_streak_chart. A guild is
+    built on first use and after that each player is re-sorted when their
+    results or participation change, so a rank is a binary search instead of
+    a full chart. A new round can break the streak of every player who skipped
+    it, so adding a game drops the index to be rebuilt.
+    """
+
+    def __init__(self, game_type_identifier: str = "gtg"):
+        self.game_type_identifier = game_type_identifier
+        self._guilds = dict[int, GuildStreaks]()
+        # Results are applied on the ingest thread, ranks are read on worker
+        # threads. The lock only guards the index, the repository is read
+        # outside of it
+        self._lock = threading.RLock()
+        # Bumped when the index is dropped, a build started before is stale
+        self._epoch = 0
+        # Players refreshed while their guild is built, by guild
+        self._building = dict[int, set[int]]()
+        # Latest refresh started for each player, an older one is not applied
+        self._refreshes = dict[tuple[int, int], int]()
+        self._refresh_count = 0
+
+    def _build(self, guild_id: int) -> GuildStreaks:
+        guild = GuildStreaks()
+        for p in repository.get_all_players(guild_id):
+            if p.visible:
+                guild.put(
+                    repository.get_current_streak(
+                        guild_id, p.user_id, self.game_type_identifier
+                    )
+                )
+        logger.debug(
+            "Streak index of guild {} built with {} players",
+            guild_id,
+            len(guild.keys),
+        )
+        return guild
+
+    def _load(self, guild_id: int) -> GuildStreaks:
+        with self._lock:
+            guild = self._guilds.get(guild_id)
+            if guild is not None:
+                return guild
+            epoch = self._epoch
+            self._building.setdefault(guild_id, set())
+
+        guild = self._build(guild_id)
+
+        with self._lock:
+            refreshed = self._building.pop(guild_id, set())
+            if self._epoch == epoch:
+                guild = self._guilds.setdefault(guild_id, guild)
+        # Changes made during the build may not have been read by it
+        for user_id in refreshed:
+            self.refresh(guild_id, user_id)
+        return guild
+
+    def load(self, guild_id: int):
+        self._load(int(guild_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._guilds.clear()
+            self._epoch += 1
+
+    def refresh(self, guild_id: int, user_id: int):
+        """Re-sorts a player after their results or participation changed."""
+        guild_id, user_id = int(guild_id), int(user_id)
+        key = (guild_id, user_id)
+        with self._lock:
+            if guild_id in self._building:
+                self._building[guild_id].add(user_id)
+            if guild_id not in self._guilds:
+                return
+            self._refresh_count += 1
+            ticket = self._refreshes[key] = self._refresh_count
+
+        p = repository.get_player(guild_id, user_id)
+        streak = (
+            repository.get_current_streak(guild_id, user_id, self.game_type_identifier)
+            if p is not None and p.active and p.visible
+            else None
+        )
+
+        with self._lock:
+            if self._refreshes.get(key) != ticket:
+                return
+            del self._refreshes[key]
+            guild = self._guilds.get(guild_id)
+            if guild is None:
+                return
+            if streak is None:
+                guild.remove(user_id)
+            else:
+                guild.put(streak)
+
+    def rank(self, guild_id: int, user_id: int) -> StreakRank | None:
+        guild = self._load(int(guild_id))
+        with self._lock:
+            index = guild.position(int(user_id))
+            return guild.rank(index) if index is not None else None
+
+    def neighbours(
+        self, guild_id: int, user_id: int, count: int = 2
+    ) -> list[StreakRank]:
+        """The player's rank with up to count players above and below."""
+        guild = self._load(int(guild_id))
+        with self._lock:
+            index = guild.position(int(user_id))
+            if index is None:
+                return []
+            return [
+                guild.rank(i)
+                for i in range(
+                    max(0, index - count), min(len(guild.keys), index + count + 1)
+                )
+            ]
+
+
+streak_index = StreakIndex()
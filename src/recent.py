@@ -0,0 +1,82 @@
+import threading
+from datetime import date
+
+RECENT_ROUNDS = 7
+
+
+class RecentResults:
+    """Players with a result in each of the latest rounds, for duplicate checks.
+
+    A round is only tracked from when it is created or loaded, so a tracked
+    round holds every result this process stored for it and a key missing
+    from it means no result. Rounds older than the latest RECENT_ROUNDS are
+    not known here and have to be looked up. Results stored by other
+    processes are caught by the unique key on Result.
+    """
+
+    def __init__(self, rounds: int = RECENT_ROUNDS):
+        self.rounds = rounds
+        # Round identifier to publish date and the (guild id, user id) keys
+        self._dates = dict[str, date]()
+        self._keys = dict[str, set[tuple[int, int]]]()
+        # Results are stored on the ingest thread, loaded on the loop's
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._keys.values())
+
+    def load(
+        self,
+        rounds: list[tuple[str, date]],
+        keys: list[tuple[int, int, str]],
+    ):
+        """Replaces the index with the results of the rounds."""
+        with self._lock:
+            self._dates.clear()
+            self._keys.clear()
+            for identifier, publish_date in rounds:
+                self._track(identifier, publish_date)
+            for guild_id, user_id, identifier in keys:
+                if identifier in self._keys:
+                    self._keys[identifier].add((guild_id, user_id))
+
+    def track(self, identifier: str, publish_date: date):
+        """Starts tracking a round that was just created, it has no results yet."""
+        with self._lock:
+            self._track(identifier, publish_date)
+
+    def _track(self, identifier: str, publish_date: date):
+        if identifier in self._keys:
+            return
+        if len(self._keys) >= self.rounds:
+            oldest = min(self._dates, key=self._dates.__getitem__)
+            if publish_date <= self._dates[oldest]:
+                return
+            del self._dates[oldest]
+            del self._keys[oldest]
+        self._dates[identifier] = publish_date
+        self._keys[identifier] = set()
+
+    def contains(self, guild_id: int, user_id: int, identifier: str) -> bool | None:
+        """Whether the player has a result in the round, None if not tracked."""
+        keys = self._keys.get(identifier)
+        if keys is None:
+            return None
+        return (guild_id, user_id) in keys
+
+    def add(self, guild_id: int, user_id: int, identifier: str):
+        with self._lock:
+            keys = self._keys.get(identifier)
+            if keys is not None:
+                keys.add((guild_id, user_id))
+
+    def discard(self, guild_id: int, user_id: int, identifier: str):
+        with self._lock:
+            keys = self._keys.get(identifier)
+            if keys is not None:
+                keys.discard((guild_id, user_id))
+
+    def clear(self):
+        with self._lock:
+            self._dates.clear()
+            self._keys.clear()
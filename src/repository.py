@@ -1,39 +1,99 @@
 import asyncio
+import threading
 from datetime import date, datetime
 
 import snowflake
-from dotenv import load_dotenv
 from loguru import logger
-from pony.orm import db_session, exists, select
+from pony.orm import TransactionIntegrityError, count, db_session, desc, exists, select
 
 from src.models import (
+    Guild,
+    GuildDto,
     Player,
     PlayerDto,
     Game,
     GameType,
     Result,
     ResultDto,
+    PeriodTotal,
+    PeriodTotalDto,
+    GuessCount,
+    GuildGuessCount,
+    GuessDistribution,
+    ResultHistory,
     PlayerTotal,
     PlayerStreak,
+    PlayerProfile,
+    LeaderboardEntry,
     db,
+    read_db,
 )
-from src.utils import Participation
-
-load_dotenv()
+from src.history import (
+    encode_rounds,
+    guesses_at,
+    is_round_identifier,
+    round_index,
+    with_round,
+)
+from src.prefix import ResultPrefix
+from src.recent import RecentResults
+from src.utils import Leaderboard, Participation, Period, period_dates, period_key
 
 snow = snowflake.Snowflake()
+recent_results = RecentResults()
 
 
 @db_session
-def player_exists(user_id: int) -> bool:
-    user_id = int(user_id)
-    return Player.exists(user_snowflake=user_id)
+def get_guild(guild_id: int) -> GuildDto | None:
+    g = Guild.get(guild_snowflake=int(guild_id))
+    return guild_to_dto(g) if g else None
+
+
+@db_session
+def get_all_guilds() -> list[GuildDto]:
+    return list(map(guild_to_dto, Guild.select()))
+
+
+def set_guild_channel(guild_id: int, channel_id: int | None) -> GuildDto:
+    guild_id = int(guild_id)
+    with db_session:
+        g = Guild.get(guild_snowflake=guild_id)
+        if g is None:
+            g = Guild(guild_snowflake=guild_id)
+        g.channel_snowflake = channel_id
+        g.flush()
+        guild = guild_to_dto(g)
+        logger.info("Guild {} has results channel set to {}.", guild_id, channel_id)
 
+    return guild
 
-def get_player(user_id: int) -> PlayerDto | None:
+
+@db_session
+def get_player_guilds(user_id: int) -> list[int]:
     user_id = int(user_id)
+    return list(
+        select(p.guild.guild_snowflake for p in Player if p.user_snowflake == user_id)
+    )
+
+
+def __get_player(entities, guild_id: int, user_id: int):
+    return entities.Player.get(
+        lambda p: p.guild.guild_snowflake == guild_id and p.user_snowflake == user_id
+    )
+
+
+@db_session
+def player_exists(guild_id: int, user_id: int) -> bool:
+    guild_id, user_id = int(guild_id), int(user_id)
+    return Player.exists(
+        lambda p: p.guild.guild_snowflake == guild_id and p.user_snowflake == user_id
+    )
+
+
+def get_player(guild_id: int, user_id: int) -> PlayerDto | None:
+    guild_id, user_id = int(guild_id), int(user_id)
     with db_session:
-        p: Player = Player.get(user_snowflake=user_id)
+        p: Player = __get_player(db, guild_id, user_id)
         if p:
             player = player_to_dto(p)
         else:
@@ -42,19 +102,31 @@ def get_player(user_id: int) -> PlayerDto | None:
     return player
 
 
-@db_session
-def get_all_players(active: bool = True, inactive: bool = False) -> list[PlayerDto]:
-    query = Player.select(lambda p: p.active == active or inactive)
-    players = list(map(player_to_dto, query))
+def get_all_players(
+    guild_id: int, active: bool = True, inactive: bool = False
+) -> list[PlayerDto]:
+    guild_id = int(guild_id)
+    with db_session:
+        query = read_db.Player.select(
+            lambda p: p.guild.guild_snowflake == guild_id
+            and (p.active == active or inactive)
+        )
+        players = list(map(player_to_dto, query))
 
     return players
 
 
-def add_player(user_id: int, message_id):
-    user_id = int(user_id)
+def add_player(guild_id: int, user_id: int, message_id):
+    guild_id, user_id = int(guild_id), int(user_id)
     with db_session:
-        if not Player.exists(user_snowflake=user_id):
+        if not __get_player(db, guild_id, user_id):
+            guild = Guild.get(guild_snowflake=guild_id)
+            if guild is None:
+                raise ValueError(
+                    f"Guild {guild_id} is not configured, add it with the guild admin command"
+                )
             p = Player(
+                guild=guild,
                 user_snowflake=user_id,
                 join_datetime=snowflake_to_datetime(message_id),
             )
@@ -65,14 +137,15 @@ def add_player(user_id: int, message_id):
 
 
 def update_player(
+    guild_id: int,
     user_id: int,
     visibility: bool = None,
     active: bool = None,
     join_datetime: datetime = None,
 ) -> PlayerDto:
-    user_id = int(user_id)
+    guild_id, user_id = int(guild_id), int(user_id)
     with db_session:
-        p = Player.get(user_snowflake=user_id)
+        p = __get_player(db, guild_id, user_id)
         if visibility is not None:
             p.visible = visibility
 
@@ -84,17 +157,18 @@ def update_player(
 
         updated_player = player_to_dto(p)
         logger.debug("Player with primary key {} updated.", p.id)
+    __invalidate_profile(guild_id, user_id)
 
     return updated_player
 
 
-def get_participation_value(user_id, participation_type: Participation):
-    user_id = int(user_id)
+def get_participation_value(guild_id, user_id, participation_type: Participation):
+    guild_id, user_id = int(guild_id), int(user_id)
     with db_session:
         pq = select(
             getattr(p, participation_type)
             for p in Player
-            if p.user_snowflake == user_id
+            if p.guild.guild_snowflake == guild_id and p.user_snowflake == user_id
         )
         p_val = pq.first()
 
@@ -117,179 +191,925 @@ def add_game(game_type_identifier: str, game_identifier: str, publish_date: date
             g.identifier,
             g.id,
         )
+        __refresh_round_period_totals(g)
+    recent_results.track(game_identifier, publish_date)
+
+
+def load_recent_results(game_type_identifier: str = "gtg") -> int:
+    """Loads the results of the latest rounds into recent_results."""
+    with db_session:
+        rounds = (
+            select(
+                (g.identifier, g.publish_date, g.id)
+                for g in read_db.Game
+                if g.game_type.identifier == game_type_identifier
+            )
+            .order_by(desc(2), desc(3))
+            .limit(recent_results.rounds)
+        )
+        rounds = [(identifier, publish_date) for identifier, publish_date, _ in rounds]
+        identifiers = [identifier for identifier, _ in rounds]
+        keys = select(
+            (r.player.guild.guild_snowflake, r.player.user_snowflake, r.game.identifier)
+            for r in read_db.Result
+            if r.game.identifier in identifiers
+        )[:]
+    recent_results.load(rounds, [tuple(k) for k in keys])
+    logger.info(
+        "Loaded {} results of the latest {} rounds", len(recent_results), len(rounds)
+    )
+    return len(recent_results)
 
 
 @db_session
-def result_exists(user_id: int, game_identifier: str):
-    user_id = int(user_id)
+def result_exists(guild_id: int, user_id: int, game_identifier: str):
+    guild_id, user_id = int(guild_id), int(user_id)
     return exists(
         r
         for r in Result
-        if r.player.user_snowflake == user_id and r.game.identifier == game_identifier
+        if r.player.guild.guild_snowflake == guild_id
+        and r.player.user_snowflake == user_id
+        and r.game.identifier == game_identifier
     )
 
 
-def add_result(user_id: int, message_id, game_identifier: str, guesses: int):
-    user_id = int(user_id)
-    with db_session:
-        p = Player.get(user_snowflake=user_id)
-        g = Game.get(identifier=game_identifier)
-        game_type_name = g.game_type.name
-        r = Result(
-            player=p,
-            game=g,
-            submit_time=snowflake_to_datetime(message_id),
-            guesses=guesses,
-            message_snowflake=message_id,
+def add_result(
+    guild_id: int, user_id: int, message_id, game_identifier: str, guesses: int
+) -> bool:
+    """Stores the result, False if the player already has one for the round."""
+    guild_id, user_id = int(guild_id), int(user_id)
+    try:
+        with db_session:
+            p = __get_player(db, guild_id, user_id)
+            g = Game.get(identifier=game_identifier)
+            game_type_name = g.game_type.name
+            r = Result(
+                player=p,
+                game=g,
+                submit_time=snowflake_to_datetime(message_id),
+                guesses=guesses,
+                message_snowflake=message_id,
+            )
+            r.flush()
+            __refresh_period_totals(p, g)
+            __count_guesses(p, g.game_type, {guesses: 1})
+            __record_history(p, g, guesses)
+            # Lazy, the local submit time is only converted when the line is written
+            logger.opt(lazy=True).info(
+                "Result of {} guesses for {} with identifier {} with submit-time {} added with primary key {}.",
+                lambda: guesses,
+                lambda: game_type_name,
+                lambda: g.identifier,
+                lambda: r.submit_time.astimezone(),
+                lambda: r.id,
+            )
+    except TransactionIntegrityError:
+        # The unique key on player and game has the final say on duplicates,
+        # the result was stored by another process since it was looked up
+        logger.info(
+            "Result of user {} in guild {} for identifier {} already stored.",
+            user_id,
+            guild_id,
+            game_identifier,
         )
-        r.flush()
+        recent_results.add(guild_id, user_id, game_identifier)
+        return False
+
+    recent_results.add(guild_id, user_id, game_identifier)
+    __invalidate_profile(guild_id, user_id)
+    return True
+
+
+def __get_message_result(guild_id: int, message_id: int, game_identifier: str):
+    return Result.get(
+        lambda r: r.message_snowflake == message_id
+        and r.game.identifier == game_identifier
+        and r.player.guild.guild_snowflake == guild_id
+    )
+
+
+@db_session
+def get_message_results(message_id: int) -> list[ResultDto]:
+    message_id = int(message_id)
+    query = Result.select(lambda r: r.message_snowflake == message_id)
+    return list(map(result_to_dto, query))
+
+
+def update_result(guild_id: int, message_id: int, game_identifier: str, guesses: int):
+    guild_id, message_id = int(guild_id), int(message_id)
+    with db_session:
+        r = __get_message_result(guild_id, message_id, game_identifier)
+        user_id = r.player.user_snowflake
+        previous_guesses = r.guesses
+        r.guesses = guesses
+        __refresh_period_totals(r.player, r.game)
+        changes = {previous_guesses: -1}
+        changes[guesses] = changes.get(guesses, 0) + 1
+        __count_guesses(r.player, r.game.game_type, changes)
+        __record_history(r.player, r.game, guesses)
         logger.info(
-            "Result of {} guesses for {} with identifier {} with submit-time {} added with primary key {}.",
-            guesses,
-            game_type_name,
-            g.identifier,
-            r.submit_time.astimezone(),
+            "Result with primary key {} for identifier {} changed from {} to {} guesses.",
             r.id,
+            game_identifier,
+            previous_guesses,
+            guesses,
         )
+    __invalidate_profile(guild_id, user_id)
 
 
-def get_all_results(limit: int, user_id: int = None):
-    user_id = int(user_id)
-    sel = (lambda r: r.player.user_snowflake == user_id) if user_id else lambda x: x
+def delete_result(guild_id: int, message_id: int, game_identifier: str):
+    guild_id, message_id = int(guild_id), int(message_id)
     with db_session:
-        query = Result.select(sel).order_by(Result.submit_time).limit(limit)
-        results = list(map(result_to_dto, query))
+        r = __get_message_result(guild_id, message_id, game_identifier)
+        user_id = r.player.user_snowflake
+        result_id = r.id
+        player, game, guesses = r.player, r.game, r.guesses
+        r.delete()
+        __refresh_period_totals(player, game)
+        __count_guesses(player, game.game_type, {guesses: -1})
+        __record_history(player, game, None)
+        logger.info(
+            "Result with primary key {} for identifier {} deleted.",
+            result_id,
+            game_identifier,
+        )
+    recent_results.discard(guild_id, user_id, game_identifier)
+    __invalidate_profile(guild_id, user_id)
+
+
+# Week and month totals, guess counters and round histories are derived from
+# the results. They are changed in the transaction of the result change, so
+# they never disagree with the results, and the rebuild functions recompute
+# them from the stored results for data stored before them.
+
+
+def __refresh_period_totals(player: Player, game: Game):
+    """Recomputes the week and month totals of the player for the game's rounds."""
+    for period in Period:
+        start, end = period_dates(period, game.publish_date)
+        key = period_key(period, game.publish_date)
+        rounds = select(
+            g
+            for g in Game
+            if g.game_type == game.game_type
+            and g.publish_date >= start
+            and g.publish_date <= end
+        ).order_by(Game.publish_date)
+        guesses = dict(
+            select(
+                (r.game.id, r.guesses)
+                for r in Result
+                if r.player == player
+                and r.game.game_type == game.game_type
+                and r.game.publish_date >= start
+                and r.game.publish_date <= end
+            )
+        )
 
-    return results
+        played = won = total_guesses = streak = max_streak = 0
+        for g in rounds:
+            result = guesses.get(g.id)
+            if result is not None:
+                played += 1
+                total_guesses += result
+            if result:
+                won += 1
+                streak += 1
+                max_streak = max(max_streak, streak)
+            else:
+                streak = 0
+
+        total = PeriodTotal.get(player=player, game_type=game.game_type, period=key)
+        if not played:
+            if total:
+                total.delete()
+        elif total:
+            total.set(
+                played=played,
+                won=won,
+                total_guesses=total_guesses,
+                max_streak=max_streak,
+            )
+        else:
+            PeriodTotal(
+                player=player,
+                game_type=game.game_type,
+                period=key,
+                played=played,
+                won=won,
+                total_guesses=total_guesses,
+                max_streak=max_streak,
+            )
 
 
-def get_player_total(
-    user_id: int, game_type_identifier: str = "gtg"
-) -> PlayerTotal | None:
-    user_id = int(user_id)
+def __refresh_round_period_totals(game: Game):
+    """Recomputes the totals of everyone with results around a round added late."""
+    # The week and the month both hold the round, together they span one range
+    periods = [period_dates(period, game.publish_date) for period in Period]
+    start = min(start for start, _ in periods)
+    end = max(end for _, end in periods)
+    if not Game.exists(
+        lambda g: g.game_type == game.game_type
+        and g.publish_date > game.publish_date
+        and g.publish_date <= end
+    ):
+        return
+
+    players = select(
+        r.player
+        for r in Result
+        if r.game.game_type == game.game_type
+        and r.game.publish_date >= start
+        and r.game.publish_date <= end
+    )
+    for player in players:
+        __refresh_period_totals(player, game)
+
+
+def rebuild_period_totals(guild_id: int | None = None) -> int:
+    """Recomputes all week and month totals, of one guild or every guild."""
     with db_session:
-        results = __all_games_and_player_results_query(
-            user_id=user_id,
-            game_type_identifier=game_type_identifier,
-            sort_order="DESC",
+        players = (
+            select(p for p in Player if p.guild.guild_snowflake == int(guild_id))
+            if guild_id is not None
+            else Player.select()
         )
-
-        played_games = 0
-        won = 0
-        streak_counter = 0
-        current_streak = None
-        max_streak = 0
-        loosing_streak = 0
-        max_loosing_streak = 0
-        last_submit_time: datetime | None = None
-
-        for _, _, submit_time, guesses in results:
-            if last_submit_time is None:
-                # This skips the first rows if player hasn't played today/for some days
-                if submit_time is None:
-                    continue
-                last_submit_time = datetime.fromisoformat(submit_time)
-
-            if submit_time is not None:
-                played_games += 1
-
-            if guesses == 0 or submit_time is None:
-                if current_streak is None:
-                    current_streak = streak_counter
-                streak_counter = 0
-                if guesses is not None:
-                    loosing_streak += 1
-                    if loosing_streak > max_loosing_streak:
-                        max_loosing_streak = loosing_streak
+        count = 0
+        for p in players:
+            p.period_totals.clear()
+            periods = set()
+            for r in p.results:
+                day = r.game.publish_date
+                key = tuple(period_key(period, day) for period in Period)
+                if key not in periods:
+                    periods.add(key)
+                    __refresh_period_totals(p, r.game)
+            count += p.period_totals.count()
+
+    return count
+
+
+def __count_guesses(player: Player, game_type: GameType, changes: dict[int, int]):
+    """Moves the player's and the guild's counters by the change in guesses."""
+    guild = player.guild
+    for entity, owner, stored in (
+        (
+            GuessCount,
+            {"player": player},
+            lambda: select(
+                (r.guesses, count(r))
+                for r in Result
+                if r.player == player and r.game.game_type == game_type
+            ),
+        ),
+        (
+            GuildGuessCount,
+            {"guild": guild},
+            lambda: select(
+                (r.guesses, count(r))
+                for r in Result
+                if r.player.guild == guild and r.game.game_type == game_type
+            ),
+        ),
+    ):
+        if not entity.exists(game_type=game_type, **owner):
+            # The results may predate the counters, they already hold the change
+            for guesses, results in stored():
+                entity(game_type=game_type, guesses=guesses, count=results, **owner)
+            continue
+
+        for guesses, change in changes.items():
+            counter = entity.get(game_type=game_type, guesses=guesses, **owner)
+            if counter is None:
+                entity(game_type=game_type, guesses=guesses, count=change, **owner)
             else:
-                loosing_streak = 0
-                won += 1
-                streak_counter += 1
-                if streak_counter > max_streak:
-                    max_streak = streak_counter
-
-        win_rate = f"{won / played_games:.2%}"
-
-        p = Player.get(user_snowflake=user_id)
-
-        total = PlayerTotal(
-            user_id=user_id,
-            played_games=played_games,
-            won=won,
-            win_rate=win_rate,
-            current_streak=current_streak,
-            max_streak=max_streak,
-            max_loosing_streak=max_loosing_streak,
-            join_date=p.join_datetime,
+                counter.count += change
+
+
+def rebuild_guess_counts(guild_id: int | None = None) -> int:
+    """Recounts the guess distributions, of one guild or every guild."""
+    with db_session:
+        guilds = (
+            select(g for g in Guild if g.guild_snowflake == int(guild_id))
+            if guild_id is not None
+            else Guild.select()
         )
+        total = 0
+        for guild in guilds:
+            guild.guess_counts.clear()
+            for p in guild.players:
+                p.guess_counts.clear()
+            # Cleared counters are deleted at the next flush, before the new
+            # ones are inserted under the same keys
+            db.flush()
+            guild_counts = dict[tuple[GameType, int], int]()
+            for player, game_type, guesses, results in select(
+                (r.player, r.game.game_type, r.guesses, count(r))
+                for r in Result
+                if r.player.guild == guild
+            ):
+                GuessCount(
+                    player=player, game_type=game_type, guesses=guesses, count=results
+                )
+                key = (game_type, guesses)
+                guild_counts[key] = guild_counts.get(key, 0) + results
+                total += results
+            for (game_type, guesses), results in guild_counts.items():
+                GuildGuessCount(
+                    guild=guild, game_type=game_type, guesses=guesses, count=results
+                )
 
     return total
 
 
-def get_current_streak(user_id: int, game_type_identifier: str = "gtg") -> PlayerStreak:
-    user_id = int(user_id)
+def __record_history(player: Player, game: Game, guesses: int | None):
+    """Sets the round in the player's history, None when its result is deleted."""
+    if not is_round_identifier(game.identifier):
+        # Stored before identifiers were checked, such a round has no byte
+        return
+
+    history = ResultHistory.get(player=player, game_type=game.game_type)
+    if history is not None:
+        history.rounds = with_round(
+            history.rounds, round_index(game.identifier), guesses
+        )
+        return
+
+    # Encoded from the stored results, which already include the change, as
+    # the player may have results from before the histories
+    rounds = select(
+        (r.game.identifier, r.guesses)
+        for r in Result
+        if r.player == player and r.game.game_type == game.game_type
+    )
+    ResultHistory(
+        player=player,
+        game_type=game.game_type,
+        rounds=encode_rounds(rounds),
+    )
+
+
+def rebuild_result_histories(guild_id: int | None = None) -> int:
+    """Re-encodes the round histories, of one guild or every guild."""
     with db_session:
-        results = __all_games_and_player_results_query(
-            user_id, game_type_identifier, sort_order="DESC"
+        guilds = (
+            select(g for g in Guild if g.guild_snowflake == int(guild_id))
+            if guild_id is not None
+            else Guild.select()
         )
+        total = 0
+        for guild in guilds:
+            for p in guild.players:
+                p.histories.clear()
+            db.flush()
+            results = dict[tuple[Player, GameType], list[tuple[str, int]]]()
+            for player, game_type, identifier, guesses in select(
+                (r.player, r.game.game_type, r.game.identifier, r.guesses)
+                for r in Result
+                if r.player.guild == guild
+            ):
+                results.setdefault((player, game_type), []).append(
+                    (identifier, guesses)
+                )
+            for (player, game_type), rounds in results.items():
+                ResultHistory(
+                    player=player, game_type=game_type, rounds=encode_rounds(rounds)
+                )
+                total += 1
+
+    return total
 
-        total_guesses = 0
-        current_streak = 0
-        last_submit_time: datetime | None = None
 
-        for _, _, submit_time, guesses in results:
-            if last_submit_time is None:
-                # This skips the first rows if player hasn't played today/for some days
-                if submit_time is None:
-                    continue
-                last_submit_time = datetime.fromisoformat(submit_time)
+def get_guess_distribution(
+    guild_id: int, user_id: int | None = None, game_type_identifier: str = "gtg"
+) -> GuessDistribution:
+    """Results by number of guesses of a player, or of the guild without one.
 
-            if guesses == 0 or guesses is None:
-                break
+    Read from the counters, at most one row for each number of guesses.
+    """
+    guild_id = int(guild_id)
+    with db_session:
+        if user_id is None:
+            counters = select(
+                (c.guesses, c.count)
+                for c in read_db.GuildGuessCount
+                if c.guild.guild_snowflake == guild_id
+                and c.game_type.identifier == game_type_identifier
+                and c.count > 0
+            )
+        else:
+            user_id = int(user_id)
+            counters = select(
+                (c.guesses, c.count)
+                for c in read_db.GuessCount
+                if c.player.guild.guild_snowflake == guild_id
+                and c.player.user_snowflake == user_id
+                and c.game_type.identifier == game_type_identifier
+                and c.count > 0
+            )
+        counts = dict(counters)
+        if not counts:
+            # Counted from the results until the first change of the player
+            # or guild seeds the counters, or rebuild_guess_counts is run
+            counts = dict(
+                select(
+                    (r.guesses, count(r))
+                    for r in read_db.Result
+                    if r.player.guild.guild_snowflake == guild_id
+                    and (user_id is None or r.player.user_snowflake == user_id)
+                    and r.game.game_type.identifier == game_type_identifier
+                )
+            )
+        return GuessDistribution(guild_id=guild_id, user_id=user_id, counts=counts)
+
+
+def get_period_chart(
+    guild_id: int,
+    period: Period,
+    day: date,
+    limit: int = 10,
+    game_type_identifier: str = "gtg",
+) -> list[PeriodTotalDto]:
+    """Top players of the week or month of the day, most rounds won first."""
+    guild_id, key = int(guild_id), period_key(period, day)
+    with db_session:
+        query = (
+            select(
+                t
+                for t in read_db.PeriodTotal
+                if t.period == key
+                and t.game_type.identifier == game_type_identifier
+                and t.player.guild.guild_snowflake == guild_id
+                and t.player.active
+                and t.player.visible
+            )
+            .order_by(lambda t: (desc(t.won), t.total_guesses, desc(t.max_streak)))
+            .limit(limit)
+        )
+        return [
+            PeriodTotalDto(
+                guild_id=guild_id,
+                user_id=t.player.user_snowflake,
+                period=t.period,
+                played=t.played,
+                won=t.won,
+                total_guesses=t.total_guesses,
+                max_streak=t.max_streak,
+            )
+            for t in query
+        ]
 
-            current_streak += 1
-            total_guesses += guesses
 
-        player_streak = PlayerStreak(
-            user_id=user_id,
-            current_streak=current_streak,
-            total_guesses=total_guesses,
-            last_submit_time=last_submit_time,
+def get_all_results(limit: int, guild_id: int, user_id: int = None):
+    guild_id = int(guild_id)
+    user_id = int(user_id) if user_id else None
+    sel = (
+        (
+            lambda r: r.player.guild.guild_snowflake == guild_id
+            and r.player.user_snowflake == user_id
+        )
+        if user_id
+        else lambda r: r.player.guild.guild_snowflake == guild_id
+    )
+    with db_session:
+        query = (
+            read_db.Result.select(sel).order_by(read_db.Result.submit_time).limit(limit)
         )
+        results = list(map(result_to_dto, query))
 
-    return player_streak
+    return results
 
 
-def get_gaps_in_results(user_id: int, game_type_identifier: str = "gtg"):
-    user_id = int(user_id)
+def get_player_total(
+    guild_id: int,
+    user_id: int,
+    game_type_identifier: str = "gtg",
+    as_of: date | None = None,
+) -> PlayerTotal | None:
+    profile = get_player_profile(guild_id, user_id, game_type_identifier, as_of)
+    return profile.total() if profile else None
+
+
+def get_current_streak(
+    guild_id: int,
+    user_id: int,
+    game_type_identifier: str = "gtg",
+    as_of: date | None = None,
+) -> PlayerStreak:
+    profile = get_player_profile(guild_id, user_id, game_type_identifier, as_of)
+    if profile is None:
+        return PlayerStreak(
+            guild_id=guild_id, user_id=user_id, current_streak=0, total_guesses=0
+        )
+    return profile.streak()
+
+
+def get_gaps_in_results(guild_id: int, user_id: int, game_type_identifier: str = "gtg"):
+    profile = get_player_profile(guild_id, user_id, game_type_identifier)
+    return profile.gaps if profile else []
+
+
+# Profiles and result prefixes by (guild, user, game type) with the version
+# they were computed for, the latest game and the player's stored state. The
+# state is read on every call so changes made by other processes, like admin
+# commands, are seen as well
+__profiles = dict[tuple[int, int, str], tuple[tuple, PlayerProfile]]()
+__prefixes = dict[tuple[int, int, str], tuple[tuple, ResultPrefix]]()
+__profiles_lock = threading.Lock()
+
+
+def __invalidate_profile(guild_id: int, user_id: int):
+    with __profiles_lock:
+        for cache in (__profiles, __prefixes):
+            for key in [k for k in cache if k[:2] == (guild_id, user_id)]:
+                del cache[key]
+
+
+def __latest_game(game_type_identifier: str) -> int | None:
+    return read_db.select(
+        """SELECT MAX(g.id) FROM Game g
+        JOIN GameType gt ON g.game_type = gt.id
+        WHERE gt.identifier = $identifier
+        """,
+        {"identifier": game_type_identifier},
+    )[0]
+
+
+def __player_version(
+    guild_id: int, user_id: int, game_type_identifier: str
+) -> tuple | None:
+    # The history changes with the guesses of any round, the count and latest
+    # id of the results with a result removed and stored again
+    rows = read_db.select(
+        """SELECT p.join_datetime,
+            (SELECT h.rounds FROM ResultHistory h
+                JOIN GameType gt ON h.game_type = gt.id
+                WHERE h.player = p.id AND gt.identifier = $identifier),
+            (SELECT COUNT(*) FROM Result r WHERE r.player = p.id),
+            (SELECT MAX(r.id) FROM Result r WHERE r.player = p.id)
+        FROM Player p JOIN Guild gu ON p.guild = gu.id
+        WHERE gu.guild_snowflake = $guild_id AND p.user_snowflake = $user_id
+        """,
+        {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "identifier": game_type_identifier,
+        },
+    )
+    return tuple(rows[0]) if rows else None
+
+
+def get_player_profile(
+    guild_id: int,
+    user_id: int,
+    game_type_identifier: str = "gtg",
+    as_of: date | None = None,
+) -> PlayerProfile | None:
+    """The player's statistics, as they were after the rounds up to as_of if given."""
+    guild_id, user_id = int(guild_id), int(user_id)
+    if as_of is not None:
+        prefix = get_result_prefix(guild_id, user_id, game_type_identifier)
+        return prefix.profile(guild_id, user_id, as_of) if prefix else None
+
+    key = (guild_id, user_id, game_type_identifier)
     with db_session:
+        player_version = __player_version(guild_id, user_id, game_type_identifier)
+        if player_version is None:
+            return None
+        latest_game = __latest_game(game_type_identifier)
+        version = (latest_game, player_version)
+
+        with __profiles_lock:
+            cached = __profiles.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        p = __get_player(read_db, guild_id, user_id)
+        if p is None:
+            return None
+
+        rounds = __game_rounds(game_type_identifier, latest_game)
+        history = memoryview(__player_history(p, game_type_identifier))
+        latest_played = next(
+            (
+                game_id
+                for index, _, game_id in reversed(rounds)
+                if guesses_at(history, index) is not None
+            ),
+            None,
+        )
+        last_submit_time = (
+            select(
+                r.submit_time
+                for r in read_db.Result
+                if r.player == p and r.game.id == latest_played
+            ).first()
+            if latest_played is not None
+            else None
+        )
+        profile = __build_profile(
+            guild_id, user_id, p.join_datetime, rounds, history, last_submit_time
+        )
+
+    with __profiles_lock:
+        # The version was read first, a change while the profile was computed
+        # gives a different version on the next call
+        __profiles[key] = (version, profile)
+
+    return profile
+
+
+# Rounds of each game type as (round index, identifier, game id) in publishing
+# order, with the latest game they were read for
+__rounds = dict[str, tuple[int, list[tuple[int, str, int]]]]()
+
+
+def __game_rounds(
+    game_type_identifier: str, latest_game: int | None
+) -> list[tuple[int, str, int]]:
+    cached = __rounds.get(game_type_identifier)
+    if cached and cached[0] == latest_game:
+        return cached[1]
+
+    rounds = [
+        (round_index(identifier), identifier, game_id)
+        for identifier, game_id in read_db.select(
+            """SELECT g.identifier, g.id FROM Game g
+            JOIN GameType gt ON g.game_type = gt.id
+            WHERE gt.identifier = $identifier
+            ORDER BY g.publish_date
+            """,
+            {"identifier": game_type_identifier},
+        )
+        if is_round_identifier(identifier)
+    ]
+    __rounds[game_type_identifier] = (latest_game, rounds)
+    return rounds
+
+
+def __player_history(player, game_type_identifier: str) -> bytes:
+    history = select(
+        h.rounds
+        for h in read_db.ResultHistory
+        if h.player == player and h.game_type.identifier == game_type_identifier
+    ).first()
+    if history is not None:
+        return history
+
+    # Not stored before the player's first change since the histories were
+    # added, until rebuild_result_histories is run
+    return encode_rounds(
+        select(
+            (r.game.identifier, r.guesses)
+            for r in read_db.Result
+            if r.player == player
+            and r.game.game_type.identifier == game_type_identifier
+        )
+    )
+
+
+def get_result_prefix(
+    guild_id: int, user_id: int, game_type_identifier: str = "gtg"
+) -> ResultPrefix | None:
+    guild_id, user_id = int(guild_id), int(user_id)
+    key = (guild_id, user_id, game_type_identifier)
+    with db_session:
+        player_version = __player_version(guild_id, user_id, game_type_identifier)
+        if player_version is None:
+            return None
+        version = (__latest_game(game_type_identifier), player_version)
+
+        with __profiles_lock:
+            cached = __prefixes.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        p = __get_player(read_db, guild_id, user_id)
+        if p is None:
+            return None
+
         results = __all_games_and_player_results_query(
-            user_id, game_type_identifier, sort_order="ASC"
+            guild_id, user_id, game_type_identifier, sort_order="ASC"
+        )
+        prefix = ResultPrefix(
+            p.join_datetime,
+            [
+                (
+                    identifier,
+                    as_date(publish_date),
+                    as_datetime(submit_time) if submit_time is not None else None,
+                    guesses,
+                )
+                for identifier, publish_date, submit_time, guesses in results
+            ],
         )
 
-    gaps = list()
-    gap_start = None
-    gap_end = None
-
-    for identifier, _, submit_time, guesses in results:
-        if submit_time:
-            if gap_start and gap_end:
-                if gap_start == gap_end:
-                    gaps.append(gap_start)
-                else:
-                    gaps.append((gap_start, gap_end))
-            gap_start = None
-            gap_end = None
+    with __profiles_lock:
+        __prefixes[key] = (version, prefix)
+
+    return prefix
+
+
+def __build_profile(
+    guild_id: int,
+    user_id: int,
+    join_datetime: datetime,
+    rounds: list[tuple[int, str, int]],
+    history: memoryview,
+    last_submit_time: datetime | None,
+) -> PlayerProfile:
+    played_games = 0
+    won = 0
+    streak_counter = 0
+    current_streak = None
+    current_streak_guesses = 0
+    max_streak = 0
+    loosing_streak = 0
+    max_loosing_streak = 0
+    started = False
+    guess_distribution = dict[int, int]()
+    gaps = list[str | tuple[str, str]]()
+    gap_start = gap_end = None
+
+    # The latest round first
+    for index, identifier, _ in reversed(rounds):
+        guesses = guesses_at(history, index)
+        if not started:
+            # This skips the latest rounds if player hasn't played today/for some days
+            if guesses is None:
+                continue
+            started = True
+
+        if guesses is None:
+            if gap_end is None:
+                gap_end = identifier
+            gap_start = identifier
+        else:
+            played_games += 1
+            guess_distribution[guesses] = guess_distribution.get(guesses, 0) + 1
+            if gap_end is not None:
+                gaps.append(gap_start if gap_start == gap_end else (gap_start, gap_end))
+                gap_start = gap_end = None
+
+        if not guesses:
+            if current_streak is None:
+                current_streak = streak_counter
+            streak_counter = 0
+            if guesses is not None:
+                loosing_streak += 1
+                if loosing_streak > max_loosing_streak:
+                    max_loosing_streak = loosing_streak
+        else:
+            loosing_streak = 0
+            won += 1
+            streak_counter += 1
+            if current_streak is None:
+                current_streak_guesses += guesses
+            if streak_counter > max_streak:
+                max_streak = streak_counter
+
+    # Rounds before the first result are missing too
+    if gap_end is not None:
+        gaps.append(gap_start if gap_start == gap_end else (gap_start, gap_end))
+    gaps.reverse()
+
+    # A player who never lost or skipped a round is still on their first streak
+    if current_streak is None:
+        current_streak = streak_counter
+
+    return PlayerProfile(
+        guild_id=guild_id,
+        user_id=user_id,
+        join_date=join_datetime,
+        played_games=played_games,
+        won=won,
+        current_streak=current_streak,
+        current_streak_guesses=current_streak_guesses,
+        max_streak=max_streak,
+        max_loosing_streak=max_loosing_streak,
+        last_submit_time=(
+            as_datetime(last_submit_time) if last_submit_time is not None else None
+        ),
+        guess_distribution=guess_distribution,
+        gaps=gaps,
+    )
+
+
+def get_leaderboard(
+    guild_id: int,
+    leaderboard: Leaderboard,
+    limit: int = 10,
+    min_games: int = 10,
+    game_type_identifier: str = "gtg",
+) -> list[LeaderboardEntry]:
+    """Top players of a guild ranked by an aggregate over all their results.
+
+    Each chart is one grouped query over active and visible players, so the
+    cost does not grow with a query per player. Win rate and average guesses
+    only rank players with at least min_games results.
+    """
+    if leaderboard is Leaderboard.CURRENT_STREAK:
+        raise ValueError("The current streak chart is built by generate_streak_chart")
+
+    params = {
+        "guild_snowflake": int(guild_id),
+        "identifier": game_type_identifier,
+        "min_games": min_games,
+        "limit": limit,
+    }
+    with db_session:
+        if leaderboard is Leaderboard.MAX_STREAK:
+            rows = __max_streak_query(params)
         else:
-            if not gap_start:
-                gap_start = identifier
-            gap_end = identifier
+            rows = __result_totals_query(leaderboard, params)
+
+        return [
+            LeaderboardEntry(
+                guild_id=guild_id,
+                user_id=user_id,
+                value=value,
+                played_games=played_games,
+            )
+            for user_id, value, played_games in rows
+        ]
+
+
+def __result_totals_query(leaderboard: Leaderboard, params: dict):
+    value, order, having = {
+        Leaderboard.WIN_RATE: (
+            "1.0 * SUM(CASE WHEN r.guesses > 0 THEN 1 ELSE 0 END) / COUNT(*)",
+            "DESC",
+            "COUNT(*) >= $min_games",
+        ),
+        Leaderboard.AVERAGE_GUESSES: (
+            "AVG(CASE WHEN r.guesses > 0 THEN 1.0 * r.guesses END)",
+            "ASC",
+            "COUNT(*) >= $min_games AND SUM(CASE WHEN r.guesses > 0 THEN 1 ELSE 0 END) > 0",
+        ),
+        Leaderboard.PLAYED_GAMES: ("COUNT(*)", "DESC", "COUNT(*) > 0"),
+    }[leaderboard]
+
+    return read_db.select(
+        f"""SELECT p.user_snowflake, {value} AS value, COUNT(*) AS played_games
+        FROM Result r
+        JOIN Player p ON r.player = p.id
+        JOIN Guild gu ON p.guild = gu.id
+        JOIN Game g ON r.game = g.id
+        JOIN GameType gt ON g.game_type = gt.id
+        WHERE gu.guild_snowflake = $guild_snowflake AND gt.identifier = $identifier
+            AND p.active AND p.visible
+        GROUP BY p.user_snowflake
+        HAVING {having}
+        ORDER BY value {order}, played_games DESC, p.user_snowflake
+        LIMIT $limit
+        """,
+        params,
+    )
 
-    return gaps
+
+def __max_streak_query(params: dict):
+    # Consecutive rounds with the same outcome share the difference between the
+    # round number and the row number within that outcome (gaps and islands)
+    return read_db.select(
+        """SELECT s.user_snowflake,
+            MAX(CASE WHEN s.won = 1 THEN s.streak ELSE 0 END) AS value,
+            SUM(s.streak) AS played_games
+        FROM (
+            SELECT w.user_snowflake, w.won, COUNT(*) AS streak
+            FROM (
+                SELECT p.user_snowflake,
+                    CASE WHEN r.guesses > 0 THEN 1 ELSE 0 END AS won,
+                    gs.round - ROW_NUMBER() OVER (
+                        PARTITION BY p.id, CASE WHEN r.guesses > 0 THEN 1 ELSE 0 END
+                        ORDER BY gs.round
+                    ) AS island
+                FROM Result r
+                JOIN Player p ON r.player = p.id
+                JOIN Guild gu ON p.guild = gu.id
+                JOIN (
+                    SELECT g.id, ROW_NUMBER() OVER (ORDER BY g.publish_date) AS round
+                    FROM Game g
+                    WHERE g.game_type = (SELECT gt.id FROM GameType gt WHERE gt.identifier = $identifier)
+                ) gs ON r.game = gs.id
+                WHERE gu.guild_snowflake = $guild_snowflake AND p.active AND p.visible
+            ) w
+            GROUP BY w.user_snowflake, w.won, w.island
+        ) s
+        GROUP BY s.user_snowflake
+        ORDER BY value DESC, played_games DESC, s.user_snowflake
+        LIMIT $limit
+        """,
+        params,
+    )
+
+
+def guild_to_dto(guild: Guild) -> GuildDto:
+    return GuildDto(guild_id=guild.guild_snowflake, channel_id=guild.channel_snowflake)
 
 
 def player_to_dto(player: Player) -> PlayerDto:
     return PlayerDto(
+        guild_id=player.guild.guild_snowflake,
         user_id=player.user_snowflake,
         join_date=player.join_datetime.astimezone().date(),
         active=player.active,
@@ -301,6 +1121,7 @@ def result_to_dto(result: Result) -> ResultDto:
     return ResultDto(
         submit_time=result.submit_time.astimezone(),
         message_id=result.message_snowflake,
+        guild_id=result.player.guild.guild_snowflake,
         user_id=result.player.user_snowflake,
         game_type_name=result.game.game_type.name,
         game_identifier=result.game.identifier,
@@ -309,26 +1130,44 @@ def result_to_dto(result: Result) -> ResultDto:
     )
 
 
+def as_datetime(value: str | datetime) -> datetime:
+    # SQLite hands back raw query timestamps as ISO strings, PostgreSQL as datetimes
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+def as_date(value: str | date) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
 def snowflake_to_datetime(snowflake_val: int):
     snowflake_datetime, *_ = snow.parse_discord_snowflake(str(snowflake_val))
     return snowflake_datetime
 
 
 def __all_games_and_player_results_query(
-    user_id: int, game_type_identifier: str = "gtg", sort_order: str = "ASC"
+    guild_id: int,
+    user_id: int,
+    game_type_identifier: str = "gtg",
+    sort_order: str = "ASC",
 ):
-    user_id = int(user_id)
+    guild_id, user_id = int(guild_id), int(user_id)
     with db_session:
-        results = db.execute(
-            f"""
-            WITH const AS (SELECT DISTINCT p.id AS player_id FROM Player p WHERE p.user_snowflake = $user_snowflake)
-            SELECT g.identifier, g.publish_date, r.submit_time, (SELECT r.guesses FROM Result r WHERE r.game = g.id AND r.player = const.player_id AND r.guesses >= 0) AS guesses
-            FROM Game g, const
+        # A single portable statement so the report is read from one consistent
+        # snapshot on both SQLite and PostgreSQL
+        results = read_db.select(
+            f"""SELECT g.identifier, g.publish_date, r.submit_time, r.guesses
+            FROM (
+                SELECT p.id AS player_id FROM Player p
+                JOIN Guild gu ON p.guild = gu.id
+                WHERE gu.guild_snowflake = $guild_snowflake AND p.user_snowflake = $user_snowflake
+            ) const
+            CROSS JOIN Game g
             LEFT JOIN Result r ON g.id = r.game AND r.player = const.player_id
-            WHERE g.game_type = (SELECT gt.id from GameType AS gt WHERE gt.identifier = $identifier)
+            WHERE g.game_type = (SELECT gt.id FROM GameType gt WHERE gt.identifier = $identifier)
             ORDER BY g.publish_date {sort_order}
             """,
             {
+                "guild_snowflake": guild_id,
                 "user_snowflake": user_id,
                 "identifier": game_type_identifier,
             },
@@ -1,70 +1,193 @@
 import asyncio
+import os
+from datetime import date
 
 from loguru import logger
 
 from src import repository
-from src.models import PlayerStreak
-from src.utils import Participation
+from src.models import (
+    GuessDistribution,
+    LeaderboardEntry,
+    PlayerProfile,
+    PlayerStreak,
+)
+from src.ranking import streak_index
+from src.utils import Leaderboard, Participation
 
 
-def get_all_players():
-    return repository.get_all_players(active=True, inactive=True)
+def get_all_players(guild_id: int):
+    return repository.get_all_players(guild_id, active=True, inactive=True)
 
 
-def toggle_player_visible(user_id) -> bool:
+def toggle_player_visible(guild_id, user_id) -> bool:
     current_vis_val = repository.get_participation_value(
-        user_id, participation_type=Participation.VISIBLE
+        guild_id, user_id, participation_type=Participation.VISIBLE
     )
-    logger.info(f"Current vis val {current_vis_val}")
+    logger.info("Current vis val {}", current_vis_val)
     updated_player = repository.update_player(
-        user_id=user_id, visibility=not current_vis_val
+        guild_id=guild_id, user_id=user_id, visibility=not current_vis_val
     )
 
     logger.info(
-        f"Player with user id: {user_id} has visible attribute set to {updated_player.visible}"
+        "Player with user id: {} has visible attribute set to {}",
+        user_id,
+        updated_player.visible,
     )
+    streak_index.refresh(guild_id, user_id)
 
     return updated_player.visible
 
 
-def toggle_player_active(user_id) -> bool:
+def toggle_player_active(guild_id, user_id) -> bool:
     current_active_val = repository.get_participation_value(
-        user_id, participation_type=Participation.ACTIVE
+        guild_id, user_id, participation_type=Participation.ACTIVE
     )
     updated_player = repository.update_player(
-        user_id=user_id, active=not current_active_val
+        guild_id=guild_id, user_id=user_id, active=not current_active_val
     )
 
     logger.info(
-        f"Player with user id: {user_id} active attribute set to {updated_player.active}"
+        "Player with user id: {} active attribute set to {}",
+        user_id,
+        updated_player.active,
     )
+    streak_index.refresh(guild_id, user_id)
 
     return updated_player.active
 
 
-def generate_streak_chart() -> list[PlayerStreak]:
-    active_players = repository.get_all_players()
+def generate_streak_chart(
+    guild_id: int, as_of: date | None = None
+) -> list[PlayerStreak]:
+    active_players = repository.get_all_players(guild_id)
     streak_results = list[PlayerStreak]()
 
     for p in active_players:
-        if p.visible:
-            streak_results.append(repository.get_current_streak(p.user_id))
+        if p.visible and as_of is None:
+            streak_results.append(repository.get_current_streak(guild_id, p.user_id))
+        elif p.visible:
+            # Players without results by then were not on the chart yet
+            profile = repository.get_player_profile(guild_id, p.user_id, as_of=as_of)
+            if profile.played_games:
+                streak_results.append(profile.streak())
 
     streak_results.sort()
 
     return streak_results
 
 
-def is_player_visible(user_id: int) -> bool:
-    p = repository.get_player(user_id)
+def generate_leaderboard(
+    guild_id: int,
+    leaderboard: Leaderboard,
+    limit: int | None = None,
+    min_games: int = 10,
+    as_of: date | None = None,
+) -> list[LeaderboardEntry]:
+    """The top players of the chart, by default the whole current streak chart
+    and the top 10 of the others."""
+    if leaderboard is Leaderboard.CURRENT_STREAK:
+        return [
+            LeaderboardEntry(
+                guild_id=guild_id,
+                user_id=s.user_id,
+                value=s.current_streak,
+            )
+            for s in generate_streak_chart(guild_id, as_of)[:limit]
+        ]
+
+    if limit is None:
+        limit = 10
+    if as_of is None:
+        return repository.get_leaderboard(guild_id, leaderboard, limit, min_games)
+
+    # The same ranking as the leaderboard queries, from each player's profile
+    # as it was then
+    entries = list[LeaderboardEntry]()
+    for p in repository.get_all_players(guild_id):
+        if not p.visible:
+            continue
+        profile = repository.get_player_profile(guild_id, p.user_id, as_of=as_of)
+        value = __leaderboard_value(profile, leaderboard, min_games)
+        if value is not None:
+            entries.append(
+                LeaderboardEntry(
+                    guild_id=guild_id,
+                    user_id=p.user_id,
+                    value=value,
+                    played_games=profile.played_games,
+                )
+            )
+
+    sign = 1 if leaderboard is Leaderboard.AVERAGE_GUESSES else -1
+    entries.sort(key=lambda e: (sign * e.value, -e.played_games, e.user_id))
+    return entries[:limit]
+
+
+def __leaderboard_value(
+    profile: PlayerProfile, leaderboard: Leaderboard, min_games: int
+) -> float | None:
+    if not profile.played_games:
+        return None
+    if leaderboard is Leaderboard.MAX_STREAK:
+        return profile.max_streak
+    if leaderboard is Leaderboard.PLAYED_GAMES:
+        return profile.played_games
+    if profile.played_games < min_games:
+        return None
+    if leaderboard is Leaderboard.WIN_RATE:
+        return profile.won / profile.played_games
+    if not profile.won:
+        return None
+    guesses = sum(g * count for g, count in profile.guess_distribution.items())
+    return guesses / profile.won
+
+
+def format_leaderboard_value(leaderboard: Leaderboard, value: float) -> str:
+    if leaderboard is Leaderboard.WIN_RATE:
+        return f"{value:.2%}"
+    if leaderboard is Leaderboard.AVERAGE_GUESSES:
+        return f"{value:.2f}"
+    return str(int(value))
+
+
+def format_guess_distribution(distribution: GuessDistribution, width: int = 20) -> str:
+    """Text bars of the results by number of guesses, lost rounds last."""
+    counts = distribution.counts
+    most = max(counts.values(), default=0)
+    rows = sorted({*range(1, 7), *counts} - {0}) + [0]
+    lines = []
+    for guesses in rows:
+        count = counts.get(guesses, 0)
+        bar = "█" * round(width * count / most) if most else ""
+        share = f"{count / distribution.played:.0%}" if distribution.played else "-"
+        lines.append(f"{guesses or 'X'} {bar:<{width}} {count} ({share})")
+    return os.linesep.join(lines)
+
+
+def is_player_visible(guild_id: int, user_id: int) -> bool:
+    p = repository.get_player(guild_id, user_id)
     return p.visible
 
 
-def is_player_active(user_id: int) -> bool:
-    p = repository.get_player(user_id)
+def is_player_active(guild_id: int, user_id: int) -> bool:
+    p = repository.get_player(guild_id, user_id)
     return p.active
 
 
+def get_result_guilds(user_id: int) -> list[int]:
+    """Guilds a result posted as a DM is registered in.
+
+    A player registered in several guilds gets the result in all of them, an
+    unknown player is registered in the only guild when there is just one.
+    """
+    guild_ids = repository.get_player_guilds(user_id)
+    if guild_ids:
+        return guild_ids
+
+    guilds = repository.get_all_guilds()
+    return [guilds[0].guild_id] if len(guilds) == 1 else []
+
+
 async def main():
     pass
 
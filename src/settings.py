@@ -0,0 +1,61 @@
+import os
+from typing import Literal, Optional
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict, model_validator
+
+
+class Settings(BaseModel):
+    """Configuration read once from the environment (and .env) at startup."""
+
+    model_config = ConfigDict(frozen=True)
+
+    token: Optional[str] = None
+    db_provider: Literal["sqlite", "postgres"] = "sqlite"
+    db_file: Optional[str] = None
+    db_host: Optional[str] = None
+    db_port: Optional[int] = None
+    db_user: Optional[str] = None
+    db_password: Optional[str] = None
+    db_name: Optional[str] = None
+    journal_file: str = "ingest.journal"
+    # Snapshots of the SQLite database, in a directory next to it
+    backup_dir: str = "backups"
+    backup_interval_minutes: Optional[int] = None
+    backup_keep: int = 7
+    environment: str = "production"
+    log_level: str = "INFO"
+    server_id: Optional[int] = None
+    gtg_channel_id: Optional[int] = None
+    loop_watchdog_ms: Optional[int] = None
+    cache_profile: Literal["default", "results"] = "results"
+    cache_members: bool = False
+    # Importing the models binds no connection, for worker processes that
+    # only read and bind read_db themselves
+    read_only: bool = False
+
+    @model_validator(mode="after")
+    def check_database(self) -> "Settings":
+        if self.db_provider == "sqlite" and not self.db_file:
+            raise ValueError("DB_FILE must be set for the sqlite provider")
+        if self.db_provider == "postgres" and not self.db_name:
+            raise ValueError("DB_NAME must be set for the postgres provider")
+        return self
+
+    def require_token(self) -> str:
+        if not self.token:
+            raise RuntimeError("TOKEN must be set to connect to Discord")
+        return self.token
+
+
+def load_settings() -> Settings:
+    load_dotenv()
+    env = {
+        name: value
+        for name in Settings.model_fields
+        if (value := os.getenv(name.upper())) not in (None, "")
+    }
+    return Settings.model_validate(env)
+
+
+settings = load_settings()
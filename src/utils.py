@@ -1,3 +1,29 @@
+import calendar
+from datetime import date, timedelta
 from enum import StrEnum
 
 Participation = StrEnum("Participation", ["ACTIVE", "VISIBLE"])
+
+Leaderboard = StrEnum(
+    "Leaderboard",
+    ["CURRENT_STREAK", "MAX_STREAK", "WIN_RATE", "AVERAGE_GUESSES", "PLAYED_GAMES"],
+)
+
+Period = StrEnum("Period", ["WEEK", "MONTH"])
+
+
+def period_key(period: Period, day: date) -> str:
+    """The ISO week ("2024-W05") or month ("2024-01") a day belongs to."""
+    if period is Period.WEEK:
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02}"
+    return f"{day:%Y-%m}"
+
+
+def period_dates(period: Period, day: date) -> tuple[date, date]:
+    """First and last day of the week or month a day belongs to."""
+    if period is Period.WEEK:
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    last = calendar.monthrange(day.year, day.month)[1]
+    return day.replace(day=1), day.replace(day=last)
@@ -0,0 +1,347 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import NamedTuple
+
+from pony.orm import db_session
+
+from src import history, models, repository
+from src.models import read_db
+from src.utils import Period, period_key
+
+
+class Mismatch(NamedTuple):
+    check: str
+    detail: str
+    guild_id: int | None = None
+    user_id: int | None = None
+
+
+class VerifyReport(NamedTuple):
+    mismatches: list[Mismatch]
+    players: int
+    results: int
+    workers: int
+    seconds: float
+
+
+def verify(
+    game_type_identifier: str = "gtg", workers: int | None = None
+) -> VerifyReport:
+    """Checks stored results against each other and the statistics built on them.
+
+    Checks over the whole database run here, the per player recomputation is
+    split over a pool of processes that read through their own read-only
+    connections.
+    """
+    start = time.perf_counter()
+    mismatches = __check_games(game_type_identifier)
+    with db_session:
+        players = read_db.select(
+            """SELECT gu.guild_snowflake, p.user_snowflake
+            FROM Player p JOIN Guild gu ON p.guild = gu.id
+            ORDER BY gu.guild_snowflake, p.user_snowflake
+            """
+        )
+
+    workers = workers or multiprocessing.cpu_count()
+    chunk_size = max(1, len(players) // (workers * 4))
+    chunks = [
+        [tuple(p) for p in players[i : i + chunk_size]]
+        for i in range(0, len(players), chunk_size)
+    ]
+    results = 0
+    # Spawned workers bind the database themselves instead of sharing the
+    # connections of this process. They import the models before the
+    # initializer runs, the environment they start with keeps that import
+    # from migrating and creating tables through a write connection
+    previous = os.environ.get("READ_ONLY")
+    os.environ["READ_ONLY"] = "1"
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=models.bind_read_db,
+        ) as pool:
+            for chunk_mismatches, chunk_results in pool.map(
+                verify_players, chunks, [game_type_identifier] * len(chunks)
+            ):
+                mismatches += chunk_mismatches
+                results += chunk_results
+    finally:
+        if previous is None:
+            del os.environ["READ_ONLY"]
+        else:
+            os.environ["READ_ONLY"] = previous
+
+    return VerifyReport(
+        mismatches=mismatches,
+        players=len(players),
+        results=results,
+        workers=workers,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def __check_games(game_type_identifier: str) -> list[Mismatch]:
+    from src.message_processing import gtg_first_date
+
+    mismatches = list[Mismatch]()
+    with db_session:
+        for guild_id, user_id, identifier, count in read_db.select(
+            """SELECT gu.guild_snowflake, p.user_snowflake, g.identifier, COUNT(*)
+            FROM Result r
+            JOIN Player p ON r.player = p.id
+            JOIN Guild gu ON p.guild = gu.id
+            JOIN Game g ON r.game = g.id
+            GROUP BY gu.guild_snowflake, p.user_snowflake, g.identifier
+            HAVING COUNT(*) > 1
+            """
+        ):
+            mismatches.append(
+                Mismatch(
+                    "duplicate",
+                    f"{count} results for round {identifier}",
+                    guild_id,
+                    user_id,
+                )
+            )
+
+        for identifier in read_db.select(
+            """SELECT g.identifier FROM Game g
+            WHERE NOT EXISTS (SELECT 1 FROM Result r WHERE r.game = g.id)
+            """
+        ):
+            mismatches.append(Mismatch("orphaned game", f"round {identifier}"))
+
+        if game_type_identifier == "gtg":
+            for identifier, publish_date in read_db.select(
+                """SELECT g.identifier, g.publish_date
+                FROM Game g JOIN GameType gt ON g.game_type = gt.id
+                WHERE gt.identifier = $identifier
+                """,
+                {"identifier": game_type_identifier},
+            ):
+                if not history.is_round_identifier(identifier):
+                    mismatches.append(
+                        Mismatch(
+                            "identifier",
+                            f"round {identifier!r} is not a round number, "
+                            "its results are left out of the statistics",
+                        )
+                    )
+                    continue
+                expected = gtg_first_date + timedelta(days=int(identifier) - 1)
+                if str(publish_date) != str(expected):
+                    mismatches.append(
+                        Mismatch(
+                            "publish date",
+                            f"round {identifier} published {publish_date}, expected {expected}",
+                        )
+                    )
+
+    return mismatches
+
+
+def verify_players(
+    players: list[tuple[int, int]], game_type_identifier: str = "gtg"
+) -> tuple[list[Mismatch], int]:
+    """Recomputes the statistics of the players from their raw results."""
+    mismatches = list[Mismatch]()
+    results = 0
+    with db_session:
+        rounds = [
+            (identifier, publish_date)
+            for identifier, publish_date in read_db.select(
+                """SELECT g.identifier, g.publish_date
+                FROM Game g JOIN GameType gt ON g.game_type = gt.id
+                WHERE gt.identifier = $identifier
+                ORDER BY g.publish_date
+                """,
+                {"identifier": game_type_identifier},
+            )
+        ]
+
+        for guild_id, user_id in players:
+            rows = read_db.select(
+                """SELECT g.identifier, r.guesses, r.submit_time, r.message_snowflake
+                FROM Result r
+                JOIN Player p ON r.player = p.id
+                JOIN Guild gu ON p.guild = gu.id
+                JOIN Game g ON r.game = g.id
+                JOIN GameType gt ON g.game_type = gt.id
+                WHERE gu.guild_snowflake = $guild_id AND p.user_snowflake = $user_id
+                    AND gt.identifier = $identifier
+                """,
+                {
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                    "identifier": game_type_identifier,
+                },
+            )
+            results += len(rows)
+
+            def mismatch(check: str, detail: str):
+                mismatches.append(Mismatch(check, detail, guild_id, user_id))
+
+            guesses = dict[str, int]()
+            for identifier, round_guesses, submit_time, message_id in rows:
+                guesses[identifier] = round_guesses
+                if not 0 <= round_guesses <= 6:
+                    mismatch(
+                        "guesses", f"{round_guesses} guesses in round {identifier}"
+                    )
+                sent = repository.snowflake_to_datetime(message_id)
+                if repository.as_datetime(submit_time) != sent.replace(tzinfo=None):
+                    mismatch(
+                        "submit time",
+                        f"round {identifier} submitted {submit_time}, message sent {sent}",
+                    )
+
+            expected = __recompute_totals(rounds, guesses)
+            profile = repository.get_player_profile(
+                guild_id, user_id, game_type_identifier
+            )
+            stored = {
+                "played": profile.played_games,
+                "won": profile.won,
+                "current_streak": profile.current_streak,
+                "max_streak": profile.max_streak,
+                "max_loosing_streak": profile.max_loosing_streak,
+            }
+            for name, value in expected.items():
+                if stored[name] != value:
+                    mismatch(name, f"{stored[name]} reported, {value} recomputed")
+
+            expected_periods = __recompute_periods(rounds, guesses)
+            stored_periods = {
+                period: (played, won, total_guesses, max_streak)
+                for period, played, won, total_guesses, max_streak in read_db.select(
+                    """SELECT t.period, t.played, t.won, t.total_guesses, t.max_streak
+                    FROM PeriodTotal t
+                    JOIN Player p ON t.player = p.id
+                    JOIN Guild gu ON p.guild = gu.id
+                    JOIN GameType gt ON t.game_type = gt.id
+                    WHERE gu.guild_snowflake = $guild_id AND p.user_snowflake = $user_id
+                        AND gt.identifier = $identifier
+                    """,
+                    {
+                        "guild_id": guild_id,
+                        "user_id": user_id,
+                        "identifier": game_type_identifier,
+                    },
+                )
+            }
+            for period in sorted(expected_periods.keys() | stored_periods.keys()):
+                if expected_periods.get(period) != stored_periods.get(period):
+                    mismatch(
+                        "period total",
+                        f"{period} stored {stored_periods.get(period)}, "
+                        f"recomputed {expected_periods.get(period)} "
+                        "(played, won, guesses, best streak)",
+                    )
+
+            expected_counts = dict[int, int]()
+            for round_guesses in guesses.values():
+                expected_counts[round_guesses] = (
+                    expected_counts.get(round_guesses, 0) + 1
+                )
+            stored_counts = repository.get_guess_distribution(
+                guild_id, user_id, game_type_identifier
+            ).counts
+            if expected_counts != stored_counts:
+                mismatch(
+                    "guess counts",
+                    f"stored {dict(sorted(stored_counts.items()))}, "
+                    f"recomputed {dict(sorted(expected_counts.items()))}",
+                )
+
+            stored_history = read_db.select(
+                """SELECT h.rounds FROM ResultHistory h
+                JOIN Player p ON h.player = p.id
+                JOIN Guild gu ON p.guild = gu.id
+                JOIN GameType gt ON h.game_type = gt.id
+                WHERE gu.guild_snowflake = $guild_id AND p.user_snowflake = $user_id
+                    AND gt.identifier = $identifier
+                """,
+                {
+                    "guild_id": guild_id,
+                    "user_id": user_id,
+                    "identifier": game_type_identifier,
+                },
+            )
+            expected_history = history.encode_rounds(guesses.items())
+            if stored_history and bytes(stored_history[0]) != expected_history:
+                stored_rounds = memoryview(bytes(stored_history[0]))
+                expected_rounds = memoryview(expected_history)
+                differing = [
+                    index + 1
+                    for index in range(max(len(stored_rounds), len(expected_rounds)))
+                    if history.guesses_at(stored_rounds, index)
+                    != history.guesses_at(expected_rounds, index)
+                ]
+                mismatch("history", f"rounds {differing} differ from the results")
+
+    return mismatches, results
+
+
+def __recompute_totals(rounds: list, guesses: dict[str, int]) -> dict[str, int]:
+    played = len(guesses)
+    won = sum(1 for g in guesses.values() if g)
+
+    max_streak = streak = 0
+    max_loosing_streak = loosing_streak = 0
+    for identifier, _ in rounds:
+        if identifier not in guesses:
+            streak = 0
+        elif guesses[identifier]:
+            streak += 1
+            max_streak = max(max_streak, streak)
+            loosing_streak = 0
+        else:
+            streak = 0
+            loosing_streak += 1
+            max_loosing_streak = max(max_loosing_streak, loosing_streak)
+
+    # Rounds after the latest result do not break the current streak
+    played_rounds = [identifier for identifier, _ in rounds]
+    while played_rounds and played_rounds[-1] not in guesses:
+        played_rounds.pop()
+    current_streak = 0
+    for identifier in reversed(played_rounds):
+        if not guesses.get(identifier):
+            break
+        current_streak += 1
+
+    return {
+        "played": played,
+        "won": won,
+        "current_streak": current_streak,
+        "max_streak": max_streak,
+        "max_loosing_streak": max_loosing_streak,
+    }
+
+
+def __recompute_periods(rounds: list, guesses: dict[str, int]) -> dict[str, tuple]:
+    totals = dict[str, list[int]]()
+    streaks = dict[str, int]()
+    for identifier, publish_date in rounds:
+        publish_date = repository.as_date(publish_date)
+        for period in Period:
+            key = period_key(period, publish_date)
+            played, won, total_guesses, max_streak = totals.get(key, [0, 0, 0, 0])
+            result = guesses.get(identifier)
+            if result is not None:
+                played += 1
+                total_guesses += result
+            if result:
+                won += 1
+                streaks[key] = streaks.get(key, 0) + 1
+                max_streak = max(max_streak, streaks[key])
+            else:
+                streaks[key] = 0
+            totals[key] = [played, won, total_guesses, max_streak]
+
+    return {key: tuple(t) for key, t in totals.items() if t[0]}
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from loguru import logger
+
+
+def label_task(name: str):
+    """Names the running task so a stall report can tell which handler blocked."""
+    task = asyncio.current_task()
+    if task is not None:
+        task.set_name(name)
+
+
+class LoopWatchdog:
+    """Measures event loop lag and reports callbacks that block the loop.
+
+    A heartbeat coroutine ticks on the loop while a monitor thread checks the
+    time since the last tick. When the loop has been blocked for longer than
+    the threshold the stack of the loop thread and the running task are logged.
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat: asyncio.Task | None = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._heartbeat = asyncio.create_task(self._beat(), name="loop-watchdog")
+        threading.Thread(
+            target=self._monitor, name="loop-watchdog", daemon=True
+        ).start()
+        logger.info(
+            "Event loop watchdog started with threshold {:.0f} ms",
+            self.threshold * 1000,
+        )
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+
+    async def _beat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._last_beat = time.monotonic()
+            lag = self._last_beat - start - self.interval
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _monitor(self):
+        stalled_since = None
+        while not self._stop.wait(self.interval):
+            blocked = time.monotonic() - self._last_beat
+            if blocked < self.threshold:
+                if stalled_since is not None:
+                    logger.warning(
+                        "Event loop was blocked for {:.0f} ms",
+                        (time.monotonic() - stalled_since) * 1000,
+                    )
+                    stalled_since = None
+                continue
+
+            if stalled_since is not None:
+                continue
+
+            stalled_since = self._last_beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            # Reading the current task from another thread is racy but only
+            # used for the report
+            task = asyncio.current_task(self._loop)
+            logger.warning(
+                "Event loop blocked for more than {:.0f} ms in {}\n{}",
+                blocked * 1000,
+                task.get_name() if task else "a callback outside of a task",
+                stack,
+            )